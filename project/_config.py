@@ -7,9 +7,124 @@ DATABASE = 'flasktaskr.db'
 WTF_CSRF_ENABLED = True  # cross-site request forgery prevention
 SECRET_KEY = 'my_precious'
 DEBUG = False
+# rows per page for each of the open/closed task lists
+TASKS_PER_PAGE = 25
 # define the full path to the DB
 DATABASE_PATH = os.path.join(basedir, DATABASE)
 
-# the database uri
-SQLALCHEMY_DATABASE_URI = 'sqlite:///' + DATABASE_PATH
+# bcrypt work factor - existing hashes are upgraded as their users log in
+BCRYPT_LOG_ROUNDS = 12
+# hash on this many background threads (0 hashes in the request thread);
+# at most BCRYPT_QUEUE_SIZE logins wait, for at most BCRYPT_TIMEOUT seconds
+BCRYPT_POOL_SIZE = 0
+BCRYPT_QUEUE_SIZE = 32
+BCRYPT_TIMEOUT = 5
 
+# rendered task tables are cached until the next change to any task, for at
+# most TASK_CACHE_TTL seconds. A change is only seen by the processes that
+# share the cache, so it's 'redis' (shared by every worker) once
+# TASK_CACHE_REDIS_URL is set, and off ('null') until then. 'lru' keeps a
+# cache per process - only for a single process server
+TASK_CACHE_REDIS_URL = os.environ.get('TASK_CACHE_REDIS_URL')
+TASK_CACHE_BACKEND = os.environ.get(
+    'TASK_CACHE_BACKEND', 'redis' if TASK_CACHE_REDIS_URL else 'null')
+TASK_CACHE_TTL = 60
+TASK_CACHE_MAX_ENTRIES = 1000
+
+# closed tasks stay on the main page for this many days; after that
+# db_archive.py moves them to the archive, this many per transaction
+TASKS_ARCHIVE_AFTER_DAYS = 30
+TASKS_ARCHIVE_BATCH_SIZE = 500
+
+# look task names up in an SQLite FTS5 index rather than with LIKE
+TASK_SEARCH_FTS = True
+
+# /tasks/events/ streams changes to the task lists to open pages. A stream
+# checks task_events every TASK_EVENTS_POLL seconds, and ends after
+# TASK_EVENTS_TIMEOUT seconds for the browser to reconnect where it left
+# off. It occupies a sync worker while it's open, so it's only served from
+# gevent ones (gunicorn -c gunicorn.conf.py wsgi:app) unless TASK_EVENTS=1;
+# without it the pages work as plain links and forms. TASK_EVENTS=0 turns
+# it off everywhere.
+TASK_EVENTS_ENABLED = {'1': True, '0': False}.get(
+    os.environ.get('TASK_EVENTS'))
+TASK_EVENTS_POLL = 1.0
+TASK_EVENTS_TIMEOUT = 300
+TASK_EVENTS_KEEPALIVE = 15
+TASK_EVENTS_BATCH = 500
+# db_archive.py forgets events older than this
+TASK_EVENTS_KEEP_HOURS = 24
+
+# background jobs (jobs.py), run by worker.py. Each worker runs at most
+# JOBS_CONCURRENCY jobs at once and checks for new ones every JOBS_POLL
+# seconds. A failed job is retried after JOBS_RETRY_DELAY seconds, doubling
+# each time, up to JOBS_MAX_ATTEMPTS runs; one still running after
+# JOBS_LOCK_TIMEOUT seconds is presumed lost with its worker and rerun
+JOBS_CONCURRENCY = 2
+JOBS_POLL = 1.0
+JOBS_MAX_ATTEMPTS = 3
+JOBS_RETRY_DELAY = 60
+JOBS_LOCK_TIMEOUT = 3600
+# (job, seconds between runs) for the jobs that repeat
+JOBS_SCHEDULE = [
+    ('archive_tasks', 60 * 60),
+    ('check_counts', 24 * 60 * 60),
+    ('queue_reminders', 15 * 60),
+]
+
+# owners are mailed about their open tasks this many days before they're
+# due; with no MAIL_SERVER the mail is only logged
+REMINDER_DAYS = 1
+MAIL_SERVER = os.environ.get('MAIL_SERVER')
+MAIL_PORT = int(os.environ.get('MAIL_PORT', 25))
+MAIL_SENDER = 'flasktaskr@localhost'
+
+# rows per executemany (and per commit) when importing tasks
+IMPORT_BATCH_SIZE = 1000
+
+# each worker keeps the logged in users' name and role for this long; a
+# role change is seen at once by the worker that makes it, by the others
+# within USER_CACHE_TTL seconds
+USER_CACHE_TTL = 30
+USER_CACHE_MAX_ENTRIES = 1000
+
+# 404s and 500s are logged here as JSON lines by a background thread
+ERROR_LOG_PATH = os.path.join(basedir, 'error.log')
+ERROR_LOG_MAX_BYTES = 10 * 1024 * 1024
+ERROR_LOG_BACKUP_COUNT = 5
+# records waiting to be written; any more are dropped, not waited for
+ERROR_LOG_QUEUE_SIZE = 10000
+# most records the writer takes off the queue for one write and flush
+ERROR_LOG_BATCH_SIZE = 500
+
+# the database uri - any SQLAlchemy URL, eg postgresql://user:pw@host/db
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL',
+                                         'sqlite:///' + DATABASE_PATH)
+
+# connection pool, per worker process
+SQLALCHEMY_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+# seconds before a connection is replaced, to stay under server timeouts
+SQLALCHEMY_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# test each connection as it leaves the pool. None (the default) does so
+# for database servers, which drop idle connections, but not for SQLite,
+# where there's no server to go away
+SQLALCHEMY_POOL_PRE_PING = {'1': True, '0': False}.get(
+    os.environ.get('DB_POOL_PRE_PING'))
+
+# applied to every new SQLite connection (None leaves SQLite's default)
+SQLITE_JOURNAL_MODE = 'WAL'     # readers don't block on writers
+SQLITE_SYNCHRONOUS = 'NORMAL'   # safe with WAL, fsyncs at checkpoints only
+SQLITE_BUSY_TIMEOUT = 5000      # ms a writer waits for the lock
+SQLITE_CACHE_SIZE = -20000      # negative is KiB, so ~20MB of page cache
+SQLITE_MMAP_SIZE = 268435456    # read up to 256MB through mmap
+
+
+# per-request timings, SQL counts and template time, served on /metrics/
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+# profile this fraction of requests with cProfile and keep the stats of any
+# that take over METRICS_SLOW_REQUEST seconds
+METRICS_PROFILE_SAMPLE_RATE = 0.0
+METRICS_SLOW_REQUEST = 1.0
+METRICS_PROFILE_DIR = os.path.join(basedir, 'profiles')
@@ -0,0 +1,166 @@
+from functools import wraps
+from flask import Blueprint, current_app, g, jsonify, request, url_for
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from extensions import db
+from views import add_task, complete_tasks, delete_tasks, \
+    modifiable_tasks, task_exists
+from forms import validate_task_row
+from models import CLOSED, OPEN, Task, User, utc_today
+from pagination import keyset_paginate
+
+
+# JSON API over the same tasks as the HTML pages
+#
+#   GET    /api/v1/tasks/?status=open|closed&after=<cursor>
+#   POST   /api/v1/tasks/
+#   GET    /api/v1/tasks/<id>
+#   POST   /api/v1/tasks/<id>/complete
+#   DELETE /api/v1/tasks/<id>
+#
+# GETs carry an ETag and Last-Modified built from the users' task_version
+# counters, so a client polling with If-None-Match gets a 304 without the
+# tasks ever being queried.
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+STATUSES = {'open': OPEN, 'closed': CLOSED}
+
+
+def api_login_required(view):
+    @wraps(view)
+    def wrap(*args, **kwargs):
+        if g.user is not None:
+            return view(*args, **kwargs)
+        return error('You need to login first', 401)
+    return wrap
+
+
+def error(message, status):
+    response = jsonify(message=message)
+    response.status_code = status
+    return response
+
+
+def task_to_dict(task):
+    return {
+        'task_id': task.task_id,
+        'name': task.name,
+        'due_date': task.due_date.isoformat(),
+        'priority': task.priority,
+        'posted_date': task.posted_date.isoformat()
+        if task.posted_date else None,
+        'status': 'open' if task.status == OPEN else 'closed',
+        'user_id': task.user_id,
+        'poster': task.poster.name,
+        'url': url_for('api.get_task', task_id=task.task_id, _external=True),
+    }
+
+
+def add_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    # clients may keep a copy but must revalidate it every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, last_modified):
+    """A 304 if the client's copy is still current, otherwise None."""
+    response = add_validators(current_app.response_class(), etag,
+                              last_modified).make_conditional(request)
+    return response if response.status_code == 304 else None
+
+
+@api.route('/tasks/', methods=['GET'])
+@api_login_required
+def list_tasks():
+    status = STATUSES.get(request.args.get('status', 'open'))
+    if status is None:
+        return error('status must be open or closed', 400)
+    # any change to anyone's tasks moves the sum of the counters on
+    version, modified = db.session.query(
+        func.coalesce(func.sum(User.task_version), 0),
+        func.max(User.tasks_modified)).one()
+    etag = 'tasks-{0}'.format(version)
+    unchanged = not_modified(etag, modified)
+    if unchanged:
+        return unchanged
+
+    page = keyset_paginate(
+        db.session.query(Task).options(joinedload(Task.poster))
+        .filter_by(status=status),
+        Task.due_date, Task.task_id, current_app.config['TASKS_PER_PAGE'],
+        after=request.args.get('after'), before=request.args.get('before'))
+    return add_validators(jsonify({
+        'tasks': [task_to_dict(task) for task in page],
+        'next': page.next_cursor,
+        'prev': page.prev_cursor,
+    }), etag, modified)
+
+
+@api.route('/tasks/', methods=['POST'])
+@api_login_required
+def create_task():
+    row = request.get_json(silent=True)
+    if not isinstance(row, dict):
+        return error('Expected a JSON object', 400)
+    form, errors = validate_task_row(row)
+    if errors:
+        response = jsonify(message='Invalid task', errors=errors)
+        response.status_code = 400
+        return response
+    task = Task(form.name.data, form.due_date.data, form.priority.data,
+                utc_today(), OPEN, g.user.id)
+    add_task(task)
+    db.session.commit()
+    response = jsonify(task_to_dict(task))
+    response.status_code = 201
+    response.headers['Location'] = url_for('api.get_task',
+                                           task_id=task.task_id,
+                                           _external=True)
+    return response
+
+
+@api.route('/tasks/<int:task_id>', methods=['GET'])
+@api_login_required
+def get_task(task_id):
+    row = db.session.query(User.task_version, User.tasks_modified)\
+        .join(Task, Task.user_id == User.id)\
+        .filter(Task.task_id == task_id).first()
+    if row is None:
+        return error('That task does not exist', 404)
+    etag = 'task-{0}-{1}'.format(task_id, row.task_version)
+    unchanged = not_modified(etag, row.tasks_modified)
+    if unchanged:
+        return unchanged
+    task = db.session.query(Task).get(task_id)
+    return add_validators(jsonify(task_to_dict(task)), etag,
+                          row.tasks_modified)
+
+
+@api.route('/tasks/<int:task_id>/complete', methods=['POST'])
+@api_login_required
+def complete_task(task_id):
+    updated = complete_tasks(modifiable_tasks([task_id]))
+    db.session.commit()
+    if updated:
+        return jsonify(message='task was marked as complete')
+    if modifiable_tasks([task_id]).count():
+        return jsonify(message='task was already complete')
+    if task_exists(task_id):
+        return error('You can only update tasks that belong to you', 403)
+    return error('That task does not exist', 404)
+
+
+@api.route('/tasks/<int:task_id>', methods=['DELETE'])
+@api_login_required
+def delete_task(task_id):
+    deleted = delete_tasks(modifiable_tasks([task_id]))
+    db.session.commit()
+    if deleted:
+        return jsonify(message='task was deleted')
+    if task_exists(task_id):
+        return error('You can only delete tasks that belong to you', 403)
+    return error('That task does not exist', 404)
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select
+
+from extensions import db
+from events import prune_events
+from jobs import job
+from views import archive_cutoff, delete_tasks
+from models import CLOSED, ArchivedTask, Task
+
+
+# Closed tasks are moved from tasks to archived_tasks once they have been
+# closed for TASKS_ARCHIVE_AFTER_DAYS, so the table every page reads only
+# holds open and recently closed tasks. Each batch is copied and deleted in
+# one transaction: an interrupted run loses nothing, and the next one
+# carries on with whatever is left.
+
+ARCHIVED_COLUMNS = ['task_id', 'name', 'due_date', 'priority', 'posted_date',
+                    'status', 'user_id', 'closed_date']
+
+
+def archive_closed_tasks(before=None, batch_size=None):
+    """Move tasks closed before `before` to the archive, batch_size at a
+    time. Returns how many were moved."""
+    before = before or archive_cutoff()
+    batch_size = batch_size or current_app.config['TASKS_ARCHIVE_BATCH_SIZE']
+    tasks = Task.__table__
+    moved = 0
+    while True:
+        rows = db.session.execute(
+            select([tasks.c[name] for name in ARCHIVED_COLUMNS])
+            .where(tasks.c.status == CLOSED)
+            .where(tasks.c.closed_date < before)
+            .order_by(tasks.c.task_id).limit(batch_size)).fetchall()
+        if not rows:
+            return moved
+        now = datetime.utcnow()
+        values = []
+        for row in rows:
+            value = dict(zip(ARCHIVED_COLUMNS, row))
+            value['archived_date'] = now
+            values.append(value)
+        db.session.execute(ArchivedTask.__table__.insert(), values)
+        delete_tasks(db.session.query(Task).filter(
+            Task.task_id.in_([value['task_id'] for value in values])))
+        db.session.commit()
+        moved += len(values)
+
+
+@job('archive_tasks')
+def archive_tasks():
+    """The scheduled run of db_archive.py: archive old closed tasks and
+    forget old task events."""
+    archive_closed_tasks()
+    prune_events(datetime.utcnow() - timedelta(
+        hours=current_app.config['TASK_EVENTS_KEEP_HOURS']))
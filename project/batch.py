@@ -0,0 +1,166 @@
+import codecs
+import csv
+import json
+
+
+# helpers for endpoints that take many tasks in one request
+
+# JSON is read this many bytes at a time; no one task may be longer
+JSON_CHUNK_SIZE = 64 * 1024
+JSON_MAX_ROW_LENGTH = 1024 * 1024
+
+
+def chunks(items, size):
+    """Split a list into lists of at most `size` items - keeps IN (...) lists
+    and executemany batches under the database's bound parameter limit."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def read_csv_rows(stream):
+    """Yield a dict per CSV line, keyed by the header row."""
+    for row in csv.DictReader(stream):
+        yield dict((key, value.decode('utf-8') if isinstance(value, bytes)
+                    else value) for key, value in row.items())
+
+
+class JSONRowReader(object):
+    """Reads a JSON list of task rows, or {"tasks": [...]}, from a UTF-8
+    file a chunk at a time. Rows are decoded as they are reached, so however
+    long the list only the row at hand is held in memory."""
+
+    def __init__(self, stream, chunk_size=JSON_CHUNK_SIZE,
+                 max_row_length=JSON_MAX_ROW_LENGTH):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_row_length = max_row_length
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.json = json.JSONDecoder()
+        self.buffer = u''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Append the next chunk to what's left of the buffer; False at the
+        end of the file."""
+        if self.eof:
+            return False
+        data = self.stream.read(self.chunk_size)
+        self.eof = not data
+        self.buffer = self.buffer[self.pos:] + \
+            self.text.decode(data, final=self.eof)
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """The next character that isn't whitespace, or u'' at the end."""
+        while True:
+            while self.pos < len(self.buffer) and \
+                    self.buffer[self.pos] in u' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def _expect(self, chars, message):
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError(message)
+        self.pos += 1
+        return char
+
+    def _value(self):
+        """Decode the next JSON value, reading as much as it takes."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                value, end = None, None
+            # a number at the end of the buffer may go on in the next chunk
+            if end is not None and (end < len(self.buffer) or self.eof):
+                self.pos = end
+                return value
+            if len(self.buffer) - self.pos > self.max_row_length:
+                raise ValueError('A task is more than {0} characters long'
+                                 .format(self.max_row_length))
+            if not self._fill():
+                raise ValueError('Invalid JSON')
+
+    def rows(self):
+        if self._expect(u'[{', 'Expected a list of tasks') == u'{':
+            # skip to the value of "tasks"
+            while True:
+                if self._peek() == u'}':
+                    raise ValueError('Expected a list of tasks')
+                key = self._value()
+                self._expect(u':', 'Invalid JSON')
+                if key == u'tasks':
+                    break
+                self._value()
+                if self._expect(u',}', 'Invalid JSON') == u'}':
+                    raise ValueError('Expected a list of tasks')
+            self._expect(u'[', 'Expected a list of tasks')
+        if self._peek() == u']':
+            return
+        while True:
+            row = self._value()
+            if not isinstance(row, dict):
+                raise ValueError('Each task must be an object')
+            yield row
+            if self._expect(u',]', 'Invalid JSON') == u']':
+                return
+
+
+def read_json_rows(stream):
+    """Yield each task row in a JSON list, or {"tasks": [...]}, as it's
+    read from `stream`."""
+    return JSONRowReader(stream).rows()
+
+
+def read_task_rows(request):
+    """Task rows posted as JSON, an uploaded CSV file or a CSV body."""
+    if request.mimetype == 'application/json':
+        return read_json_rows(request.stream)
+    if 'file' in request.files:
+        return read_csv_rows(request.files['file'].stream)
+    if request.mimetype == 'text/csv':
+        return read_csv_rows(request.stream)
+    raise ValueError('Send tasks as JSON or CSV')
+
+
+class ImportReport(object):
+    """What an import_rows() run has done so far - still accurate if the
+    input turns out to be malformed part way through."""
+
+    def __init__(self):
+        self.imported = 0
+        self.errors = []
+
+    def as_dict(self):
+        return {'imported': self.imported, 'errors': self.errors}
+
+
+def import_rows(rows, validate, insert, batch_size, report=None):
+    """Validate each row and insert the valid ones batch_size at a time.
+
+    `validate(row)` returns (values, errors); rows with errors are recorded
+    in the report by row number and skipped, the rest are passed on to
+    `insert(values_list)`. Rows are consumed as they are read, so only one
+    batch is held in memory.
+    """
+    report = report or ImportReport()
+    batch = []
+    for number, row in enumerate(rows, 1):
+        values, errors = validate(row)
+        if errors:
+            report.errors.append({'row': number, 'errors': errors})
+            continue
+        batch.append(values)
+        if len(batch) >= batch_size:
+            insert(batch)
+            report.imported += len(batch)
+            batch = []
+    if batch:
+        insert(batch)
+        report.imported += len(batch)
+    return report
@@ -0,0 +1,312 @@
+"""Latency, throughput and SQL statement counts for the request hot paths.
+
+Seeds a fresh database with N users and M tasks, then times
+
+    GET /             GET /tasks/          POST /add/
+    GET /complete/<id>/                    GET /delete/<id>/
+
+either in-process through the Flask test client (which also counts the SQL
+statements each request issues) or over HTTP against a local gunicorn.
+Every run is appended to a results file and compared with the previous run
+of the same mode, so slowdowns show up as regressions.
+
+    python bench.py [--users 50] [--tasks 5000] [--requests 200]
+                    [--gunicorn] [--workers 2]
+                    [--results bench_results.json] [--threshold 0.2]
+                    [--fail-on-regression]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+from sqlalchemy import event
+
+from factory import create_app
+from extensions import bcrypt, db
+from models import Task, User
+
+try:
+    from urllib import urlencode
+    from urllib2 import HTTPCookieProcessor, HTTPError, \
+        HTTPRedirectHandler, URLError, build_opener
+    from cookielib import CookieJar
+except ImportError:
+    from urllib.parse import urlencode
+    from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, \
+        build_opener
+    from urllib.error import HTTPError, URLError
+    from http.cookiejar import CookieJar
+
+
+USER = 'bench'
+PASSWORD = 'benchmark'
+NEW_TASK = dict(name='Benchmark task', due_date='02/05/2015', priority='5')
+# both modes measure the queries and rendering, not the fragment cache
+CACHE_BACKEND = 'null'
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def seed(users, tasks):
+    """Create the tables, `users` users (the first can log in as USER)
+    and `tasks` tasks spread over them. Returns USER's open task ids."""
+    db.create_all()
+    password = bcrypt.generate_password_hash(PASSWORD)
+    db.session.add(User(USER, USER + '@realpython.com', password))
+    db.session.add_all(User('user{0}'.format(i),
+                            'user{0}@realpython.com'.format(i), password)
+                       for i in range(1, users))
+    db.session.flush()
+    user_ids = [user_id for user_id, in
+                db.session.query(User.id).order_by(User.id)]
+    rows = [dict(name='Task {0}'.format(i),
+                 due_date=date(2015, 1 + i % 12, 1 + i % 28),
+                 priority=1 + i % 10, posted_date=date(2015, 1, 1),
+                 status=1 if i % 3 else 0,
+                 user_id=user_ids[i % len(user_ids)])
+            for i in range(tasks)]
+    for start in range(0, len(rows), 1000):
+        db.session.execute(Task.__table__.insert(), rows[start:start + 1000])
+    db.session.commit()
+    task_ids = [task_id for task_id, in db.session.query(Task.task_id)
+                .filter_by(user_id=user_ids[0], status=1)
+                .order_by(Task.task_id)]
+    db.session.remove()
+    return task_ids
+
+
+class TestClientRunner(object):
+    """Requests through app.test_client(), counting SQL per request."""
+
+    mode = 'test-client'
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.statements = 0
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.statements += 1
+
+    def login(self):
+        self.client.post('/', data=dict(name=USER, password=PASSWORD))
+
+    def request(self, method, path, data=None):
+        self.statements = 0
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, self.statements
+
+    def close(self):
+        event.remove(db.engine, 'before_cursor_execute', self._count)
+
+
+class NoRedirects(HTTPRedirectHandler):
+    # time the request itself, like the test client does, not the redirect
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class GunicornRunner(object):
+    """Requests over HTTP to gunicorn serving wsgi:app on the same DB."""
+
+    mode = 'gunicorn'
+
+    def __init__(self, database_uri, workers, port=8765):
+        self.base = 'http://127.0.0.1:{0}'.format(port)
+        gunicorn = os.path.join(os.path.dirname(sys.executable), 'gunicorn')
+        if not os.path.exists(gunicorn):
+            gunicorn = 'gunicorn'
+        self.server = subprocess.Popen(
+            [gunicorn, '-w', str(workers), '-b', '127.0.0.1:{0}'.format(port),
+             'wsgi:app'],
+            env=dict(os.environ, DATABASE_URL=database_uri,
+                     TASK_CACHE_BACKEND=CACHE_BACKEND),
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()),
+                                   NoRedirects())
+        self.csrf_token = None
+        for _ in range(50):
+            if self._open('GET', '/') == 200:
+                break
+            time.sleep(0.2)
+        else:
+            self.close()
+            raise RuntimeError('gunicorn did not start on ' + self.base)
+
+    def _open(self, method, path, data=None):
+        body = None
+        if method == 'POST':
+            data = dict(data or {}, csrf_token=self.csrf_token)
+            body = urlencode(data).encode('utf-8')
+        try:
+            return self.opener.open(self.base + path, body).getcode()
+        except HTTPError as e:
+            return e.code
+        except URLError:
+            return 599
+
+    def _read_csrf_token(self, path):
+        # forms are CSRF protected; one token is good for the whole session
+        page = self.opener.open(self.base + path).read().decode('utf-8')
+        self.csrf_token = CSRF_TOKEN.search(page).group(1)
+
+    def login(self):
+        self._read_csrf_token('/')
+        self._open('POST', '/', dict(name=USER, password=PASSWORD))
+        self._read_csrf_token('/tasks/')
+
+    def request(self, method, path, data=None):
+        return self._open(method, path, data), None
+
+    def close(self):
+        self.server.terminate()
+        self.server.wait()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(runner, name, requests):
+    """Time `requests` calls; `requests` yields (method, path, data)."""
+    latencies, statements, errors = [], [], 0
+    started = time.time()
+    for method, path, data in requests:
+        start = time.time()
+        status, count = runner.request(method, path, data)
+        latencies.append(time.time() - start)
+        if status >= 400:
+            errors += 1
+        if count is not None:
+            statements.append(count)
+    elapsed = time.time() - started
+    result = {
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': errors,
+    }
+    if statements:
+        result['sql_per_request'] = percentile(statements, 0.5)
+    return name, result
+
+
+def run(runner, task_ids, count):
+    runner.login()
+    # complete the first half of the bench user's tasks, delete the rest
+    half = len(task_ids) // 2
+    to_complete = task_ids[:min(count, half)]
+    to_delete = task_ids[half:half + count]
+    return dict([
+        measure(runner, 'GET /', (('GET', '/', None)
+                                  for _ in range(count))),
+        measure(runner, 'GET /tasks/', (('GET', '/tasks/', None)
+                                        for _ in range(count))),
+        measure(runner, 'POST /add/', (('POST', '/add/', NEW_TASK)
+                                       for _ in range(count))),
+        measure(runner, 'GET /complete/<id>/', (
+            ('GET', '/complete/{0}/'.format(task_id), None)
+            for task_id in to_complete)),
+        measure(runner, 'GET /delete/<id>/', (
+            ('GET', '/delete/{0}/'.format(task_id), None)
+            for task_id in to_delete)),
+    ])
+
+
+def previous_run(history, mode):
+    for entry in reversed(history):
+        if entry['mode'] == mode:
+            return entry
+    return None
+
+
+def report(results, previous, threshold):
+    """Print the results; returns the endpoints whose p50 got slower by
+    more than `threshold` (a fraction) since the previous run."""
+    regressions = []
+    print('{0:22} {1:>9} {2:>9} {3:>9} {4:>9} {5:>5} {6:>7}'.format(
+        'endpoint', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'sql', 'change'))
+    for name in sorted(results):
+        result = results[name]
+        change = ''
+        before = previous and previous['results'].get(name)
+        if before and before['p50_ms']:
+            ratio = result['p50_ms'] / before['p50_ms'] - 1
+            change = '{0:+.0%}'.format(ratio)
+            if ratio > threshold:
+                regressions.append(name)
+                change += ' !'
+        print('{0:22} {1:9.1f} {2:9.2f} {3:9.2f} {4:9.2f} {5:>5} {6:>7}'
+              .format(name, result['throughput'] or 0, result['p50_ms'],
+                      result['p95_ms'], result['p99_ms'],
+                      result.get('sql_per_request', '-'), change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--tasks', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--gunicorn', action='store_true')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--results', default='bench_results.json')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    database_uri = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    app = create_app(dict(
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        WTF_CSRF_ENABLED=args.gunicorn,
+        # cheap hashes for the seeded users; logins aren't what's measured
+        BCRYPT_LOG_ROUNDS=4,
+        TASK_CACHE_BACKEND=CACHE_BACKEND,
+    ))
+    try:
+        with app.app_context():
+            task_ids = seed(args.users, args.tasks)
+            if args.gunicorn:
+                runner = GunicornRunner(database_uri, args.workers)
+            else:
+                runner = TestClientRunner(app)
+            try:
+                results = run(runner, task_ids, args.requests)
+            finally:
+                runner.close()
+    finally:
+        shutil.rmtree(directory)
+
+    history = []
+    if os.path.exists(args.results):
+        with open(args.results) as f:
+            history = json.load(f)
+    regressions = report(results, previous_run(history, runner.mode),
+                         args.threshold)
+    history.append({
+        'time': datetime.utcnow().isoformat(),
+        'mode': runner.mode,
+        'users': args.users,
+        'tasks': args.tasks,
+        'results': results,
+    })
+    with open(args.results, 'w') as f:
+        json.dump(history, f, indent=2, sort_keys=True)
+    if regressions:
+        print('slower than the previous run: ' + ', '.join(regressions))
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
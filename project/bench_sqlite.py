@@ -0,0 +1,110 @@
+"""Read throughput on /tasks/ while tasks are being written.
+
+Runs the same workload against a fresh SQLite file once per journal mode:
+reader threads load /tasks/ as fast as they can while a writer thread keeps
+posting /add/. Prints requests per second and latency for each.
+
+    python bench_sqlite.py [--seconds 10] [--readers 4] [--tasks 2000]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date
+
+from factory import create_app
+from extensions import bcrypt, db
+from models import Task, User
+
+
+def seed(tasks):
+    db.create_all()
+    user = User('bench', 'bench@realpython.com',
+                bcrypt.generate_password_hash('bench', 4))
+    db.session.add(user)
+    db.session.flush()
+    db.session.execute(Task.__table__.insert(), [
+        dict(name='Task {0}'.format(i), due_date=date(2015, 1 + i % 12, 1),
+             priority=1 + i % 10, posted_date=date(2015, 1, 1),
+             status=i % 2, user_id=user.id) for i in range(tasks)])
+    db.session.commit()
+    db.session.remove()
+
+
+def logged_in_client(app):
+    client = app.test_client()
+    client.post('/', data=dict(name='bench', password='bench'))
+    return client
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(journal_mode, seconds, readers, tasks, directory):
+    app = create_app(dict(
+        WTF_CSRF_ENABLED=False,
+        SQLITE_JOURNAL_MODE=journal_mode,
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(
+            directory, 'bench-{0}.db'.format(journal_mode.lower())),
+        # measure the database, not the fragment cache
+        TASK_CACHE_BACKEND='null',
+    ))
+    with app.app_context():
+        seed(tasks)
+
+    stop = threading.Event()
+    latencies, writes, errors = [], [0], [0]
+
+    def read():
+        client = logged_in_client(app)
+        while not stop.is_set():
+            start = time.time()
+            response = client.get('/tasks/')
+            if response.status_code == 200:
+                latencies.append(time.time() - start)
+            else:
+                errors[0] += 1
+
+    def write():
+        client = logged_in_client(app)
+        while not stop.is_set():
+            response = client.post('/add/', data=dict(
+                name='Written', due_date='02/05/2015', priority='1'))
+            if response.status_code == 302:
+                writes[0] += 1
+            else:
+                errors[0] += 1
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    print('{0:8} {1:8.1f} reads/s  p50 {2:6.1f}ms  p95 {3:6.1f}ms  '
+          '{4:5} writes  {5} errors'.format(
+              journal_mode, len(latencies) / float(seconds),
+              percentile(latencies, 0.5) * 1000,
+              percentile(latencies, 0.95) * 1000, writes[0], errors[0]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--tasks', type=int, default=2000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        for mode in ('DELETE', 'WAL'):
+            run(mode, args.seconds, args.readers, args.tasks, directory)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,235 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+# Server side cache for rendered task tables. Entries are never deleted one
+# by one: every key includes a generation number, and a write to the tasks
+# bumps the generation, so all older entries stop being found and simply
+# age out of the backend.
+GENERATION_KEY = 'tasks:generation'
+
+
+class CacheBackend(object):
+    """The store behind TaskCache - implement these to plug in another."""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def incr(self, key):
+        """Add one to an integer (missing keys count as 0), return it."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class NullBackend(CacheBackend):
+    """Caches nothing - every lookup is a miss."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def incr(self, key):
+        return 0
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUBackend(CacheBackend):
+    """In-process store holding the most recently used `max_entries` keys,
+    each for at most its ttl seconds. Local to one worker process, so other
+    workers only see a write once their own copies expire."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # counters are kept apart so they are never evicted
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                return None
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._counters.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+
+class RedisBackend(CacheBackend):
+    """Store shared by every worker, on a redis-py style client."""
+
+    def __init__(self, client, prefix='flasktaskr:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return value
+
+    def set(self, key, value, ttl):
+        self.client.setex(self.prefix + key, ttl, value)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+def make_backend(config):
+    backend = config.get('TASK_CACHE_BACKEND', 'null')
+    if backend == 'lru':
+        return LRUBackend(config.get('TASK_CACHE_MAX_ENTRIES', 1000))
+    if backend == 'redis':
+        import redis
+        return RedisBackend(redis.StrictRedis.from_url(
+            config['TASK_CACHE_REDIS_URL']))
+    if backend == 'null':
+        return NullBackend()
+    raise ValueError('Unknown TASK_CACHE_BACKEND {0!r}'.format(backend))
+
+
+class TaskCache(object):
+    """Rendered fragments keyed on the current task generation.
+
+    Each app gets its own backend and hit counts, in
+    app.extensions['task_cache']; this object only finds the current app's.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['task_cache'] = TaskCacheState(make_backend(app.config))
+
+    @property
+    def state(self):
+        return current_app.extensions['task_cache']
+
+    @property
+    def backend(self):
+        return self.state.backend
+
+    def fragment(self, key, render):
+        """The cached value for `key`, calling render() to fill a miss."""
+        state = self.state
+        key = 'tasks:{0}:{1}'.format(
+            state.backend.get(GENERATION_KEY) or 0, key)
+        value = state.backend.get(key)
+        if value is not None:
+            state.hits += 1
+            return value
+        state.misses += 1
+        value = render()
+        state.backend.set(key, value,
+                          current_app.config.get('TASK_CACHE_TTL', 60))
+        return value
+
+    def invalidate(self):
+        self.backend.incr(GENERATION_KEY)
+
+    def stats(self):
+        state = self.state
+        lookups = state.hits + state.misses
+        return {
+            'backend': type(state.backend).__name__,
+            'hits': state.hits,
+            'misses': state.misses,
+            'hit_ratio': float(state.hits) / lookups if lookups else None,
+        }
+
+
+class TaskCacheState(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+
+class UserCache(object):
+    """The logged in users, as loaded by `load(user_id)`, kept per process
+    for at most USER_CACHE_TTL seconds. Always in process: it saves a
+    query per request, so it has to be cheaper than one. Each app has its
+    own, in app.extensions['user_cache'] - user ids mean nothing outside
+    the database they came from."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['user_cache'] = LRUBackend(
+            app.config.get('USER_CACHE_MAX_ENTRIES', 1000))
+
+    @property
+    def backend(self):
+        return current_app.extensions['user_cache']
+
+    def get(self, user_id, load):
+        key = 'user:{0}'.format(user_id)
+        user = self.backend.get(key)
+        if user is None:
+            user = load(user_id)
+            if user is not None:
+                self.backend.set(key, user,
+                                 current_app.config.get('USER_CACHE_TTL', 30))
+        return user
+
+    def invalidate(self, user_id):
+        self.backend.delete('user:{0}'.format(user_id))
@@ -0,0 +1,176 @@
+from collections import defaultdict
+from datetime import date
+
+from flask import current_app
+from sqlalchemy import false, func, select
+
+from extensions import db
+from jobs import job
+from models import OPEN, Task, TaskCount, User
+
+
+# Per user, priority and status task counts, maintained in task_counts as
+# part of the same transaction as each task write. Writes that change tasks
+# in bulk count the affected rows with one GROUP BY query first, so keeping
+# the counters costs a query or two per request however many tasks change.
+# The rows are locked before they're counted, so two requests changing the
+# same tasks can't both count them.
+# Anything that writes tasks some other way can leave them out of step;
+# db_counts.py (or the scheduled check_counts job) checks and rebuilds them.
+
+COUNT_KEY = (Task.user_id, Task.priority, Task.status)
+
+
+def lock_tasks(tasks):
+    """Keep every other transaction from changing the tasks a query
+    matches until this one ends.
+
+    PostgreSQL and the like lock the rows themselves. SQLite only has its
+    one write lock, which a write that matches nothing takes; every read
+    after it sees the latest data, and nobody else can write until commit.
+    """
+    if db.session.get_bind(Task.__mapper__).dialect.name == 'sqlite':
+        tasks_table = Task.__table__
+        db.session.execute(tasks_table.update().where(false())
+                           .values(status=tasks_table.c.status))
+    else:
+        tasks.with_entities(Task.task_id).with_for_update().all()
+
+
+def count_changes(tasks):
+    """(user_id, priority, status, n) for the tasks a query matches - call
+    it before updating or deleting them. Those tasks stay locked until the
+    transaction ends, so the write changes exactly what was counted."""
+    lock_tasks(tasks)
+    return tasks.with_entities(*COUNT_KEY + (func.count(Task.task_id),))\
+        .group_by(*COUNT_KEY).all()
+
+
+def adjust_counts(deltas):
+    """Add each {(user_id, priority, status): n} to its counter."""
+    counts = TaskCount.__table__
+    for (user_id, priority, status), n in deltas.items():
+        if not n:
+            continue
+        key = (counts.c.user_id == user_id) & \
+            (counts.c.priority == priority) & (counts.c.status == status)
+        updated = db.session.execute(
+            counts.update().where(key).values(count=counts.c.count + n))
+        if not updated.rowcount:
+            db.session.execute(counts.insert().values(
+                user_id=user_id, priority=priority, status=status, count=n))
+
+
+def add_counts(rows):
+    """Count new tasks - insert values dicts, as given to executemany."""
+    deltas = defaultdict(int)
+    for row in rows:
+        deltas[(row['user_id'], row['priority'], row['status'])] += 1
+    adjust_counts(deltas)
+
+
+def move_counts(changes, status):
+    """Move the count_changes() rows over to another status."""
+    deltas = defaultdict(int)
+    for user_id, priority, old_status, n in changes:
+        deltas[(user_id, priority, old_status)] -= n
+        deltas[(user_id, priority, status)] += n
+    adjust_counts(deltas)
+
+
+def remove_counts(changes):
+    """Take deleted count_changes() rows off the counters."""
+    adjust_counts(dict(((user_id, priority, status), -n)
+                       for user_id, priority, status, n in changes))
+
+
+def summary(user_ids=None, today=None):
+    """Open, closed and overdue counts for each user, in total and by
+    priority, as a list of dicts ordered by user name.
+
+    Open and closed come from task_counts, one row per user and priority.
+    Overdue depends on the date, so it's counted live - but only over the
+    open tasks already past due, a range of the (status, due_date) index.
+    """
+    users = db.session.query(User.id, User.name).order_by(User.name)
+    counts = db.session.query(TaskCount).filter(TaskCount.count != 0)
+    overdue = db.session.query(
+        Task.user_id, Task.priority, func.count(Task.task_id))\
+        .filter(Task.status == OPEN,
+                Task.due_date < (today or date.today()))\
+        .group_by(Task.user_id, Task.priority)
+    if user_ids is not None:
+        users = users.filter(User.id.in_(user_ids))
+        counts = counts.filter(TaskCount.user_id.in_(user_ids))
+        overdue = overdue.filter(Task.user_id.in_(user_ids))
+
+    result = {}
+    for user_id, name in users:
+        result[user_id] = {'user_id': user_id, 'name': name, 'open': 0,
+                           'closed': 0, 'overdue': 0, 'priorities': {}}
+
+    def bucket(user_id, priority):
+        return result[user_id]['priorities'].setdefault(
+            priority, {'open': 0, 'closed': 0, 'overdue': 0})
+
+    for count in counts:
+        if count.user_id not in result:
+            continue
+        column = 'open' if count.status == OPEN else 'closed'
+        result[count.user_id][column] += count.count
+        bucket(count.user_id, count.priority)[column] += count.count
+    for user_id, priority, n in overdue:
+        if user_id not in result:
+            continue
+        result[user_id]['overdue'] += n
+        bucket(user_id, priority)['overdue'] += n
+    return sorted(result.values(), key=lambda user: user['name'])
+
+
+def actual_counts(connection):
+    return dict(((user_id, priority, status), n) for
+                user_id, priority, status, n in connection.execute(
+                    select(list(COUNT_KEY) + [func.count(Task.task_id)])
+                    .where(Task.user_id != None)
+                    .group_by(*COUNT_KEY)))
+
+
+def stored_counts(connection):
+    counts = TaskCount.__table__
+    return dict(((row.user_id, row.priority, row.status), row.count)
+                for row in connection.execute(
+                    counts.select().where(counts.c.count != 0)))
+
+
+def differences(connection):
+    """{key: (stored, actual)} for every counter that is wrong."""
+    stored, actual = stored_counts(connection), actual_counts(connection)
+    return dict((key, (stored.get(key, 0), actual.get(key, 0)))
+                for key in set(stored) | set(actual)
+                if stored.get(key, 0) != actual.get(key, 0))
+
+
+def rebuild_counts(connection):
+    """Recount everything from the tasks table, in one transaction."""
+    counts = TaskCount.__table__
+    with connection.begin():
+        connection.execute(counts.delete())
+        connection.execute(counts.insert().from_select(
+            ['user_id', 'priority', 'status', 'count'],
+            select(list(COUNT_KEY) + [func.count(Task.task_id)])
+            .where(Task.user_id != None)
+            .group_by(*COUNT_KEY)))
+
+
+@job('check_counts')
+def check_counts():
+    """Rebuild task_counts if anything has put it out of step."""
+    connection = db.engine.connect()
+    try:
+        wrong = differences(connection)
+        if wrong:
+            current_app.logger.warning(
+                '%d task counter(s) were wrong - rebuilding', len(wrong))
+            rebuild_counts(connection)
+    finally:
+        connection.close()
@@ -0,0 +1,94 @@
+import sqlite3
+import weakref
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc, select
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
+
+
+# SQLite settings are per connection, so they're applied to every new
+# connection as the pool opens it. With WAL, readers no longer wait for a
+# writer (and vice versa); busy_timeout makes a second writer wait for the
+# lock instead of failing with "database is locked".
+SQLITE_PRAGMAS = [
+    ('journal_mode', 'SQLITE_JOURNAL_MODE'),
+    ('synchronous', 'SQLITE_SYNCHRONOUS'),
+    ('busy_timeout', 'SQLITE_BUSY_TIMEOUT'),
+    ('cache_size', 'SQLITE_CACHE_SIZE'),
+    ('mmap_size', 'SQLITE_MMAP_SIZE'),
+]
+
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+class Database(SQLAlchemy):
+    """Flask-SQLAlchemy plus the connection handling the app relies on.
+
+    - SQLite files get a real connection pool when SQLALCHEMY_POOL_SIZE is
+      set, instead of a new connection (and new pragmas) per request
+    - each new SQLite connection gets the SQLITE_* pragmas
+    - with SQLALCHEMY_POOL_PRE_PING, a pooled connection is tested before
+      it's handed out, and quietly replaced if the server dropped it; left
+      at None, that's done for everything but SQLite
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._configured = weakref.WeakKeyDictionary()
+        super(Database, self).__init__(*args, **kwargs)
+
+    def apply_driver_hacks(self, app, info, options):
+        sqlite_file = info.drivername == 'sqlite' and \
+            info.database not in (None, '', ':memory:')
+        super(Database, self).apply_driver_hacks(app, info, options)
+        if sqlite_file and options.get('pool_size'):
+            options['poolclass'] = QueuePool
+            # pooled connections move between threads, one at a time
+            options.setdefault('connect_args', {})['check_same_thread'] = \
+                False
+        if options.get('poolclass') in (NullPool, StaticPool):
+            for option in POOL_OPTIONS:
+                options.pop(option, None)
+
+    def get_engine(self, app=None, bind=None):
+        engine = super(Database, self).get_engine(app, bind)
+        if engine not in self._configured:
+            self._configured[engine] = True
+            self.init_engine(self.get_app(app), engine)
+        return engine
+
+    def init_engine(self, app, engine):
+        if engine.dialect.name == 'sqlite':
+            @event.listens_for(engine, 'connect')
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                if not isinstance(dbapi_connection, sqlite3.Connection):
+                    return
+                cursor = dbapi_connection.cursor()
+                for pragma, key in SQLITE_PRAGMAS:
+                    value = app.config.get(key)
+                    if value is not None:
+                        cursor.execute('PRAGMA {0} = {1}'.format(pragma, value))
+                cursor.close()
+
+        pre_ping = app.config.get('SQLALCHEMY_POOL_PRE_PING')
+        if pre_ping is None:
+            pre_ping = engine.dialect.name != 'sqlite'
+        if pre_ping:
+            event.listen(engine, 'engine_connect', ping_connection)
+
+
+def ping_connection(connection, branch):
+    # "pessimistic disconnect handling" - run a trivial query on checkout;
+    # if the connection turns out to be dead SQLAlchemy invalidates it and
+    # the retry gets a fresh one
+    if branch:
+        return
+    should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as e:
+        if not e.connection_invalidated:
+            raise
+        connection.scalar(select([1]))
+    finally:
+        connection.should_close_with_result = should_close_with_result
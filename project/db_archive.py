@@ -0,0 +1,35 @@
+import argparse
+from datetime import datetime, timedelta
+
+from factory import create_app
+from views import archive_cutoff
+from archive import archive_closed_tasks
+from events import prune_events
+
+
+# Move tasks closed more than TASKS_ARCHIVE_AFTER_DAYS ago (or --days) to
+# archived_tasks, and forget task events older than TASK_EVENTS_KEEP_HOURS.
+# Safe to run at any time, and to interrupt.
+#
+#   python db_archive.py [--days 30] [--batch 500]
+
+
+def main():
+    app = create_app()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int,
+                        default=app.config['TASKS_ARCHIVE_AFTER_DAYS'])
+    parser.add_argument('--batch', type=int,
+                        default=app.config['TASKS_ARCHIVE_BATCH_SIZE'])
+    args = parser.parse_args()
+
+    with app.app_context():
+        moved = archive_closed_tasks(archive_cutoff(args.days), args.batch)
+        pruned = prune_events(datetime.utcnow() - timedelta(
+            hours=app.config['TASK_EVENTS_KEEP_HOURS']))
+    print('{0} task(s) archived'.format(moved))
+    print('{0} task event(s) pruned'.format(pruned))
+
+
+if __name__ == '__main__':
+    main()
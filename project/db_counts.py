@@ -0,0 +1,35 @@
+import sys
+
+from factory import create_app
+from extensions import db
+from counters import differences, rebuild_counts
+
+
+# The task_counts summary is updated along with every task write the app
+# makes; this puts it right after anything else has changed the tasks.
+#
+#   python db_counts.py          recount everything
+#   python db_counts.py --check  list wrong counters, exit 1 if there are any
+
+
+def main():
+    connection = db.engine.connect()
+    try:
+        if '--check' in sys.argv:
+            wrong = differences(connection)
+            for (user_id, priority, status), (stored, actual) in \
+                    sorted(wrong.items()):
+                print('user {0} priority {1} status {2}: {3} stored, {4} '
+                      'tasks'.format(user_id, priority, status, stored,
+                                     actual))
+            print('{0} counter(s) wrong'.format(len(wrong)))
+            sys.exit(1 if wrong else 0)
+        rebuild_counts(connection)
+        print('task counts rebuilt')
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    with create_app().app_context():
+        main()
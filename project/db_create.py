@@ -14,14 +14,20 @@ from _config import DATABASE
 #                   VALUES('Finish real python course 2','03/25/2013', 10, 1)""")
 
 
-from views import db
+from factory import create_app
+from extensions import db
 from models import Task
+from db_migrate import stamp
 from datetime import date
 
-db.create_all()
+with create_app().app_context():
+    db.create_all()
 
-# insert dummy data
-#db.session.add(Task("Finish this tutorial", date(2015, 3, 13), 10, 1))
-#db.session.add(Task("Finish realpython", date(2015, 3, 13), 10, 1))
+    # insert dummy data
+    #db.session.add(Task("Finish this tutorial", date(2015, 3, 13), 10, 1))
+    #db.session.add(Task("Finish realpython", date(2015, 3, 13), 10, 1))
 
-db.session.commit()
+    db.session.commit()
+
+    # the tables are already in their latest shape
+    stamp()
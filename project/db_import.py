@@ -0,0 +1,48 @@
+import argparse
+import sys
+
+from factory import create_app
+from views import import_tasks
+from models import User
+from batch import read_csv_rows, read_json_rows
+
+
+# Load existing tasks for a user from a CSV (with a header row naming
+# name, due_date and priority) or JSON file. Rows are checked against the
+# same rules as the add task form; bad ones are listed and skipped.
+#
+#   python db_import.py tasks.csv --user michael [--batch 500]
+
+
+def read_rows(f, path):
+    if path.endswith('.json'):
+        return read_json_rows(f)
+    return read_csv_rows(f)
+
+
+def main():
+    app = create_app()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--batch', type=int,
+                        default=app.config['IMPORT_BATCH_SIZE'])
+    args = parser.parse_args()
+
+    with app.test_request_context():
+        user = User.query.filter_by(name=args.user).first()
+        if user is None:
+            sys.exit('No user called {0}'.format(args.user))
+        with open(args.path, 'rb') as f:
+            report = import_tasks(read_rows(f, args.path), user.id,
+                                  args.batch)
+    for error in report.errors:
+        print('row {0}: {1}'.format(error['row'], '; '.join(
+            '{0}: {1}'.format(field, ', '.join(messages))
+            for field, messages in sorted(error['errors'].items()))))
+    print('{0} task(s) imported, {1} row(s) skipped'.format(
+        report.imported, len(report.errors)))
+
+
+if __name__ == '__main__':
+    main()
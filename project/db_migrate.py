@@ -1,8 +1,192 @@
-from views import db
-from _config import DATABASE_PATH
-import sqlite3
+import sys
+from contextlib import contextmanager
 from datetime import datetime
 
+from extensions import db
+from models import ArchivedTask, Job, Task, TaskCount, TaskEvent, User
+from search import create_fts
+from counters import rebuild_counts
+from sqlalchemy import Integer, SmallInteger, cast, column, func, or_, \
+    select, table, text
+from sqlalchemy.engine.reflection import Inspector
+
+
+# Versioned migrations. Every step is recorded in the schema_version table
+# once it has finished, and each step is written so that running it again
+# after an interruption picks up where it left off - so a crash half way
+# through copying a big table costs one batch, not the whole migration.
+# Everything goes through the app's engine, so this works on whatever
+# database SQLALCHEMY_DATABASE_URI points at.
+#
+#   python db_migrate.py              apply any outstanding steps
+#   python db_migrate.py --batch 500  ... copying 500 rows per transaction
+
+BATCH_SIZE = 1000
+
+schema_version = db.Table(
+    'schema_version',
+    db.Column('version', db.Integer, nullable=False)
+)
+
+
+def connect():
+    return db.engine.connect()
+
+
+def table_exists(connection, name):
+    return connection.dialect.has_table(connection, name)
+
+
+def column_names(connection, name):
+    return [info['name'] for info in
+            Inspector.from_engine(connection).get_columns(name)]
+
+
+def current_version(connection):
+    schema_version.create(connection, checkfirst=True)
+    return connection.scalar(select([func.max(schema_version.c.version)])) \
+        or 0
+
+
+def set_version(connection, version):
+    with connection.begin():
+        connection.execute(schema_version.delete())
+        connection.execute(schema_version.insert(), version=version)
+
+
+@contextmanager
+def ddl_transaction(connection):
+    """Run the schema changes made inside as one transaction, so an
+    interruption leaves all or none of them.
+
+    SQLite can roll DDL back, but Python 2's sqlite3 commits before every
+    DDL statement unless it's told to keep out of it and the transaction is
+    begun by hand.
+    """
+    if connection.dialect.name != 'sqlite':
+        with connection.begin():
+            yield
+        return
+    dbapi_connection = connection.connection.connection
+    isolation_level = dbapi_connection.isolation_level
+    dbapi_connection.isolation_level = None
+    try:
+        with connection.begin():
+            connection.execute(text("BEGIN"))
+            yield
+    finally:
+        dbapi_connection.isolation_level = isolation_level
+
+
+def batches(connection, source, key, start, batch_size):
+    """Yield rows of `source` with `key` > start, batch_size rows at a time.
+
+    Each batch is a fresh keyset query, so only one batch is ever in memory
+    and no read cursor is held open across the commits in between.
+    """
+    while True:
+        rows = connection.execute(
+            select(source.c).where(source.c[key] > start)
+            .order_by(source.c[key]).limit(batch_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        start = rows[-1][key]
+
+
+def copy_rows(connection, source, target, columns, key,
+              extra=None, batch_size=BATCH_SIZE):
+    """Copy `columns` from the source table name to the target Table,
+    committing after each batch.
+
+    Keys are copied as well, so the copy resumes after the highest key
+    already in the target. `extra` maps more target columns to constants.
+    """
+    # read with the target's types so dates come back as dates
+    source = table(source, *[column(name, target.c[name].type)
+                             for name in columns])
+    start = connection.scalar(
+        select([func.coalesce(func.max(target.c[key]), 0)]))
+    copied = 0
+    for rows in batches(connection, source, key, start, batch_size):
+        values = []
+        for row in rows:
+            value = dict(zip(columns, row))
+            value.update(extra or {})
+            values.append(value)
+        with connection.begin():
+            connection.execute(target.insert(), values)
+        copied += len(rows)
+    return copied
+
+
+def rebuild_table(connection, model, columns, extra=None,
+                  batch_size=BATCH_SIZE):
+    """Recreate `model`'s table from its current definition, keeping rows.
+
+    The old table is renamed to old_<table> and the new one created in one
+    transaction, then the rows are copied across in batches; when a
+    previous run was interrupted the copy simply carries on.
+    """
+    name = model.__tablename__
+    backup = 'old_' + name
+    key = model.__mapper__.primary_key[0].name
+    if not table_exists(connection, backup):
+        if connection.dialect.name == 'sqlite':
+            # keep other tables' foreign keys pointing at the new table
+            connection.execute(text("PRAGMA legacy_alter_table = ON"))
+        indexes = Inspector.from_engine(connection).get_indexes(name)
+        with ddl_transaction(connection):
+            connection.execute(text("ALTER TABLE {0} RENAME TO {1}".format(
+                name, backup)))
+            # index names are shared by every table; the new table reuses
+            # them
+            for index in indexes:
+                connection.execute(text("DROP INDEX {0}".format(
+                    index['name'])))
+            model.__table__.create(connection)
+    if not table_exists(connection, name):
+        # left half done by a run from before the rename and create were
+        # one transaction
+        model.__table__.create(connection)
+    copy_rows(connection, backup, model.__table__, columns, key, extra,
+              batch_size)
+    connection.execute(text("DROP TABLE {0}".format(backup)))
+
+
+def has_autoincrement(connection, name):
+    """True if the SQLite table was created with an AUTOINCREMENT key."""
+    sql = connection.scalar(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        name=name)
+    return sql is not None and 'AUTOINCREMENT' in sql.upper()
+
+
+def start_sequence_after(connection, name, highest):
+    """Make the SQLite table's next AUTOINCREMENT id come after `highest`."""
+    seq = connection.scalar(text(
+        "SELECT seq FROM sqlite_sequence WHERE name = :name"), name=name)
+    if seq is None:
+        connection.execute(text(
+            "INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"),
+            name=name, seq=highest)
+    elif seq < highest:
+        connection.execute(text(
+            "UPDATE sqlite_sequence SET seq = :seq WHERE name = :name"),
+            name=name, seq=highest)
+
+
+def add_column(connection, model, name):
+    """ALTER TABLE ... ADD COLUMN for a column declared on the model."""
+    col = model.__table__.c[name]
+    ddl = "ALTER TABLE {0} ADD COLUMN {1} {2}".format(
+        model.__tablename__, name, col.type.compile(connection.dialect))
+    if col.server_default is not None:
+        ddl += " DEFAULT {0}".format(col.server_default.arg)
+    if not col.nullable:
+        ddl += " NOT NULL"
+    connection.execute(text(ddl))
+
 
 # with sqlite3.connect(DATABASE_PATH) as connection:
 #     c = connection.cursor()
@@ -18,15 +202,231 @@ from datetime import datetime
 #                     VALUES (?, ?, ?, ?, ?, ?)""", data)
 #     c.execute("""DROP TABLE old_tasks""")
 
-with sqlite3.connect(DATABASE_PATH) as connection:
-    c = connection.cursor()
-    c.execute("""ALTER TABLE users RENAME TO old_users""")
-    db.create_all()
-    c.execute("""SELECT name, email, password
-                FROM old_users ORDER BY id ASC""")
-    data = [(row[0], row[1], row[2], 'user') for row in c.fetchall()]
-    c.executemany("""INSERT INTO users (name, email, password,
-                role) VALUES (?, ?, ?, ?)""", data)
 
-    c.execute("""DROP TABLE old_users""")
+def add_user_roles(connection, batch_size):
+    """users gained a role column; every existing user becomes a 'user'."""
+    if 'role' in column_names(connection, 'users') and \
+            not table_exists(connection, 'old_users'):
+        return
+    rebuild_table(connection, User, ['id', 'name', 'email', 'password'],
+                  extra={'role': 'user'}, batch_size=batch_size)
+
+
+def add_task_indexes(connection, batch_size):
+    """Build the indexes declared on Task that the database doesn't have.
+
+    CREATE INDEX works on the live table, so no rename-and-copy is needed.
+    """
+    existing = set(index['name'] for index in
+                   Inspector.from_engine(connection).get_indexes('tasks'))
+    columns = set(column_names(connection, 'tasks'))
+    for index in Task.__table__.indexes:
+        # indexes on columns a later step adds are left to that step
+        if index.name not in existing and \
+                all(col.name in columns for col in index.columns):
+            index.create(connection)
+
+
+def add_task_versions(connection, batch_size):
+    """users gained the change counter the JSON API builds ETags from."""
+    columns = column_names(connection, 'users')
+    for name in ('task_version', 'tasks_modified'):
+        if name not in columns:
+            add_column(connection, User, name)
+
+
+def add_task_search(connection, batch_size):
+    """Index the existing task names for search (SQLite only)."""
+    if connection.dialect.name == 'sqlite':
+        create_fts(connection)
+
+
+def add_task_counts(connection, batch_size):
+    """The dashboard's task_counts summary, counted from the tasks."""
+    TaskCount.__table__.create(connection, checkfirst=True)
+    rebuild_counts(connection)
+
+
+def add_session_versions(connection, batch_size):
+    """users gained the counter that sessions are checked against."""
+    if 'session_version' not in column_names(connection, 'users'):
+        add_column(connection, User, 'session_version')
+
+
+def add_task_archive(connection, batch_size):
+    """tasks gained closed_date, and old closed tasks an archive table.
+
+    When existing tasks were closed isn't known, so they count as closed
+    now - the archive job will take them once they reach the age limit.
+    """
+    if 'closed_date' not in column_names(connection, 'tasks'):
+        add_column(connection, Task, 'closed_date')
+    tasks = Task.__table__
+    connection.execute(tasks.update()
+                       .where(tasks.c.status == 0)
+                       .where(tasks.c.closed_date == None)
+                       .values(closed_date=datetime.utcnow()))
+    add_task_indexes(connection, batch_size)
+    ArchivedTask.__table__.create(connection, checkfirst=True)
+
+
+def add_task_events(connection, batch_size):
+    """The log of task changes the task pages' event streams follow."""
+    TaskEvent.__table__.create(connection, checkfirst=True)
+
+
+def add_jobs(connection, batch_size):
+    """The background job queue, and tasks' record of due date reminders."""
+    Job.__table__.create(connection, checkfirst=True)
+    if 'reminded_date' not in column_names(connection, 'tasks'):
+        add_column(connection, Task, 'reminded_date')
+
+
+def normalise_task_types(connection, batch_size):
+    """status (now a SMALLINT) and priority stored as integers.
+
+    They used to be written as the strings the forms gave. An INTEGER column
+    in SQLite turns those into numbers as they're stored, but a column with
+    no declared type keeps them as text, and then no comparison with a
+    number - or index range on one - finds them. Those are cast in
+    batch_size runs of task_id, each in its own transaction. PostgreSQL
+    changes the column types instead.
+    """
+    for model in (Task, ArchivedTask):
+        tasks = model.__table__
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text(
+                'ALTER TABLE {0} ALTER COLUMN status TYPE SMALLINT '
+                'USING status::smallint'.format(tasks.name)))
+            continue
+        if connection.dialect.name != 'sqlite':
+            continue
+        untyped = or_(func.typeof(tasks.c.status) == 'text',
+                      func.typeof(tasks.c.priority) == 'text')
+        last = 0
+        while True:
+            batch = select([tasks.c.task_id]).where(tasks.c.task_id > last)\
+                .order_by(tasks.c.task_id).limit(batch_size).alias()
+            upper = connection.scalar(select([func.max(batch.c.task_id)]))
+            if upper is None:
+                break
+            with connection.begin():
+                connection.execute(
+                    tasks.update()
+                    .where(tasks.c.task_id > last)
+                    .where(tasks.c.task_id <= upper).where(untyped)
+                    .values(status=cast(tasks.c.status, SmallInteger),
+                            priority=cast(tasks.c.priority, Integer)))
+            last = upper
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('ALTER TABLE task_counts ALTER COLUMN status '
+                                'TYPE SMALLINT USING status::smallint'))
+
+
+def add_task_autoincrement(connection, batch_size):
+    """tasks' ids are never handed out twice (SQLite AUTOINCREMENT).
+
+    Without it SQLite gave the highest id to the next task once that one
+    was archived, and archiving the new one then clashed with the old in
+    archived_tasks. The table is rebuilt, any live task already sharing an
+    id with an archived one is given a new id, the sequence is started
+    after every id either table has used and the search index is rebuilt
+    to match. Server databases' sequences never went back, so they're left
+    alone.
+    """
+    if connection.dialect.name != 'sqlite':
+        return
+    if not has_autoincrement(connection, 'tasks') or \
+            table_exists(connection, 'old_tasks'):
+        rebuild_table(connection, Task,
+                      [col.name for col in Task.__table__.columns],
+                      batch_size=batch_size)
+    tasks, archived = Task.__table__, ArchivedTask.__table__
+    with connection.begin():
+        highest = max(
+            connection.scalar(select([func.max(tasks.c.task_id)])) or 0,
+            connection.scalar(select([func.max(archived.c.task_id)])) or 0)
+        connection.execute(
+            tasks.update()
+            .where(tasks.c.task_id.in_(select([archived.c.task_id])))
+            .values(task_id=tasks.c.task_id + highest))
+        start_sequence_after(connection, 'tasks', connection.scalar(
+            select([func.max(tasks.c.task_id)])) or 0)
+        start_sequence_after(connection, 'tasks', highest)
+    create_fts(connection)
+
+
+def add_event_autoincrement(connection, batch_size):
+    """task_events' ids are never handed out twice (SQLite AUTOINCREMENT).
+
+    After pruning SQLite started again from the highest id left - from 1
+    once every event was gone - and streams already past that missed
+    everything until the ids caught up. The table is rebuilt and its
+    sequence started after the highest id still there.
+    """
+    if connection.dialect.name != 'sqlite':
+        return
+    if not has_autoincrement(connection, 'task_events') or \
+            table_exists(connection, 'old_task_events'):
+        rebuild_table(connection, TaskEvent,
+                      [col.name for col in TaskEvent.__table__.columns],
+                      batch_size=batch_size)
+    events = TaskEvent.__table__
+    with connection.begin():
+        start_sequence_after(connection, 'task_events', connection.scalar(
+            select([func.max(events.c.id)])) or 0)
+
+
+# (version, step) in the order they have to run - only ever append to this
+MIGRATIONS = [
+    (1, add_user_roles),
+    (2, add_task_indexes),
+    (3, add_task_versions),
+    (4, add_task_search),
+    (5, add_task_counts),
+    (6, add_session_versions),
+    (7, add_task_archive),
+    (8, add_task_events),
+    (9, add_jobs),
+    (10, normalise_task_types),
+    (11, add_task_autoincrement),
+    (12, add_event_autoincrement),
+]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def migrate(batch_size=BATCH_SIZE):
+    connection = connect()
+    try:
+        version = current_version(connection)
+        for step_version, step in MIGRATIONS:
+            if step_version <= version:
+                continue
+            print('applying migration {0}: {1}'.format(
+                step_version, step.__name__))
+            step(connection, batch_size)
+            set_version(connection, step_version)
+    finally:
+        connection.close()
+
+
+def stamp(version=None):
+    """Mark a database built straight from the models as fully migrated."""
+    connection = connect()
+    try:
+        current_version(connection)
+        set_version(connection, version or latest_version())
+    finally:
+        connection.close()
+
 
+if __name__ == '__main__':
+    size = BATCH_SIZE
+    if '--batch' in sys.argv:
+        size = int(sys.argv[sys.argv.index('--batch') + 1])
+    from factory import create_app
+    with create_app().app_context():
+        migrate(size)
@@ -0,0 +1,37 @@
+import argparse
+import sys
+
+from factory import create_app
+from extensions import db
+from views import set_role
+from models import User
+
+
+# Give a user a role - admins can see the dashboard for everyone, the cache
+# statistics and the metrics, and export tasks. Their sessions end, so the
+# change applies from their next login.
+#
+#   python db_role.py michael admin
+#   python db_role.py michael user
+
+ROLES = ('user', 'admin')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('user')
+    parser.add_argument('role', choices=ROLES)
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        user = User.query.filter_by(name=args.user).first()
+        if user is None:
+            sys.exit('No user called {0}'.format(args.user))
+        set_role(user.id, args.role)
+        db.session.commit()
+    print('{0} is now {1} {2}'.format(
+        args.user, 'an' if args.role == 'admin' else 'a', args.role))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import atexit
+import json
+import os
+import threading
+from datetime import datetime
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from flask import current_app
+
+
+class ErrorLog(object):
+    """Append-only log of error records written by a background thread.
+
+    log() only puts the record on a bounded queue, so a burst of 404s never
+    waits on the disk. The writer thread drains whatever has queued up,
+    writes it as JSON lines with a single flush and rotates the file once
+    it grows past ERROR_LOG_MAX_BYTES. If the queue is full records are
+    dropped (and counted) rather than blocking the request. Each app has
+    its own file, queue and thread, in app.extensions['error_log'].
+    """
+
+    def __init__(self, app=None):
+        self._writers = []
+        atexit.register(self.flush_all)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        writer = ErrorLogWriter(
+            config.get('ERROR_LOG_PATH', 'error.log'),
+            config.get('ERROR_LOG_MAX_BYTES', 10 * 1024 * 1024),
+            config.get('ERROR_LOG_BACKUP_COUNT', 5),
+            config.get('ERROR_LOG_BATCH_SIZE', 500),
+            config.get('ERROR_LOG_QUEUE_SIZE', 10000))
+        app.extensions['error_log'] = writer
+        self._writers.append(writer)
+
+    @property
+    def writer(self):
+        return current_app.extensions['error_log']
+
+    def log(self, record):
+        self.writer.log(record)
+
+    def flush(self):
+        """Block until every record the current app has queued so far has
+        been written."""
+        self.writer.flush()
+
+    def flush_all(self):
+        for writer in self._writers:
+            writer.flush()
+
+
+class ErrorLogWriter(object):
+    """One app's error log file, and the thread that appends to it."""
+
+    def __init__(self, path, max_bytes, backup_count, batch_size,
+                 queue_size):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def log(self, record):
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Block until every record queued so far has been written."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def _ensure_writer(self):
+        # started lazily, and again in each forked gunicorn worker - threads
+        # don't survive a fork. The queue is made afresh as well: a copy of
+        # the parent's would hand its records to both processes' writers.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(self.queue_size)
+                self._thread = threading.Thread(target=self._write_forever,
+                                                args=(self._queue,),
+                                                name='error-log-writer')
+                self._thread.daemon = True
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _write_forever(self, records):
+        while True:
+            batch = [records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(records.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except (IOError, OSError):
+                pass  # nowhere left to report it; keep the thread alive
+            finally:
+                for _ in batch:
+                    records.task_done()
+
+    def write(self, records):
+        data = ''.join(json.dumps(record, sort_keys=True) + '\n'
+                       for record in records)
+        if self._size() + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, 'a') as f:
+            f.write(data)
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def _rotate(self):
+        # error.log -> error.log.1 -> error.log.2 ... oldest one is dropped
+        for number in range(self.backup_count - 1, 0, -1):
+            older = '{0}.{1}'.format(self.path, number)
+            if os.path.exists(older):
+                os.rename(older, '{0}.{1}'.format(self.path, number + 1))
+        if os.path.exists(self.path):
+            if self.backup_count:
+                os.rename(self.path, self.path + '.1')
+            else:
+                os.remove(self.path)
+
+
+def request_record(request, status, error=None):
+    """The structured record logged for a failed request."""
+    record = {
+        'time': datetime.utcnow().isoformat() + 'Z',
+        'status': status,
+        'method': request.method,
+        'url': request.url,
+        'remote_addr': request.remote_addr,
+        'user_agent': request.headers.get('User-Agent'),
+    }
+    if error is not None:
+        record['error'] = repr(error)
+    return record
@@ -0,0 +1,65 @@
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, literal
+
+from extensions import db
+from models import Task, TaskEvent
+
+
+# Every task write also appends to task_events, in the same transaction, so
+# the ids in there are the order the changes happened in. The task pages
+# follow them with a server-sent event stream (/tasks/events/) instead of
+# reloading: each open stream asks for the events after the last one it
+# sent, a primary key range, and pushes the rows that changed.
+
+ADDED = 'added'
+COMPLETED = 'completed'
+DELETED = 'deleted'
+# a bulk insert doesn't know its task_ids; the pages fetch their tables again
+RELOAD = 'reload'
+
+
+def streaming_enabled():
+    """Whether to serve the stream: TASK_EVENTS_ENABLED, or if that's None
+    whether gevent has patched sockets, as its gunicorn workers do - then
+    an open stream only holds a greenlet, not a whole worker."""
+    enabled = current_app.config['TASK_EVENTS_ENABLED']
+    if enabled is None:
+        try:
+            from gevent import monkey
+        except ImportError:
+            return False
+        return monkey.is_module_patched('socket')
+    return enabled
+
+
+def record_event(task_id, action):
+    db.session.add(TaskEvent(task_id, action))
+
+
+def record_events(tasks, action):
+    """Log `action` for every task a query matches, with one INSERT ...
+    SELECT - call it before updating or deleting them."""
+    db.session.execute(TaskEvent.__table__.insert().from_select(
+        ['task_id', 'action', 'created'],
+        tasks.with_entities(Task.task_id, literal(action),
+                            literal(datetime.utcnow())).statement))
+
+
+def latest_event_id():
+    return db.session.query(func.max(TaskEvent.id)).scalar() or 0
+
+
+def events_after(event_id, limit):
+    return db.session.query(TaskEvent).filter(TaskEvent.id > event_id)\
+        .order_by(TaskEvent.id).limit(limit).all()
+
+
+def prune_events(before):
+    """Forget events logged before `before`; returns how many."""
+    deleted = db.session.query(TaskEvent)\
+        .filter(TaskEvent.created < before)\
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
@@ -0,0 +1,128 @@
+import csv
+import json
+import sys
+from datetime import datetime
+
+from flask import Blueprint, Response, g, jsonify, request, \
+    stream_with_context
+
+from extensions import db
+from views import login_required
+from models import CLOSED, OPEN, Task, User
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+if sys.version_info[0] >= 3:
+    text_type = str
+else:
+    text_type = unicode
+
+
+def csv_value(value):
+    """Python 2's csv module writes bytes, so text is encoded for it."""
+    if isinstance(value, text_type) and not isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+# Admin export of every task, streamed
+#
+#   GET /export/tasks.csv
+#   GET /export/tasks.ndjson
+#       ?status=open|closed&owner=<user id>&due_from=YYYY-MM-DD&due_to=...
+#
+# Rows are fetched EXPORT_BATCH_SIZE at a time (yield_per) and written out
+# as they arrive, so memory stays flat however many tasks there are.
+export = Blueprint('export', __name__, url_prefix='/export')
+
+EXPORT_BATCH_SIZE = 1000
+STATUSES = {'open': OPEN, 'closed': CLOSED}
+COLUMNS = ['task_id', 'name', 'due_date', 'priority', 'posted_date',
+           'status', 'user_id', 'poster']
+
+
+def export_query(args):
+    """Plain column rows for the filters in `args`; ValueError if bad."""
+    query = db.session.query(
+        Task.task_id, Task.name, Task.due_date, Task.priority,
+        Task.posted_date, Task.status, Task.user_id, User.name
+    ).join(User, Task.user_id == User.id)
+    if args.get('status'):
+        if args['status'] not in STATUSES:
+            raise ValueError('status must be open or closed')
+        query = query.filter(Task.status == STATUSES[args['status']])
+    if args.get('owner'):
+        if not args['owner'].isdigit():
+            raise ValueError('owner must be a user id')
+        query = query.filter(Task.user_id == int(args['owner']))
+    if args.get('due_from'):
+        query = query.filter(Task.due_date >= parse_date(args['due_from']))
+    if args.get('due_to'):
+        query = query.filter(Task.due_date <= parse_date(args['due_to']))
+    return query.order_by(Task.task_id).yield_per(EXPORT_BATCH_SIZE)
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('dates must be YYYY-MM-DD')
+
+
+def row_values(row):
+    values = list(row)
+    values[2] = values[2].isoformat()
+    values[4] = values[4].isoformat() if values[4] else None
+    values[5] = 'open' if values[5] == OPEN else 'closed'
+    return values
+
+
+def csv_lines(rows):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow(values)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    yield line(COLUMNS)
+    # one CSV line at a time, never the whole file
+    for row in rows:
+        yield line([csv_value(value) for value in row_values(row)])
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, row_values(row)))) + '\n'
+
+
+FORMATS = {
+    'csv': ('text/csv', csv_lines),
+    'ndjson': ('application/x-ndjson', ndjson_lines),
+}
+
+
+@export.route('/tasks.<format>')
+@login_required
+def export_tasks(format):
+    if g.user.role != "admin":
+        return jsonify(message='Only admins can export tasks'), 403
+    if format not in FORMATS:
+        return jsonify(message='Export as csv or ndjson'), 404
+    try:
+        rows = export_query(request.args)
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    mimetype, lines = FORMATS[format]
+    # the request context, and with it the session, stays open while the
+    # rows stream out
+    response = Response(stream_with_context(lines(rows)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = \
+        'attachment; filename=tasks.{0}'.format(format)
+    return response
@@ -0,0 +1,20 @@
+from flask_bcrypt import Bcrypt
+
+from cache import TaskCache, UserCache
+from database import Database
+from errorlog import ErrorLog
+from hashing import PasswordHasher
+from metrics import Metrics
+
+
+# Created unbound, so models and helpers can import them without building
+# an app; create_app() in factory.py binds each one to the app it makes.
+# Whatever they hold per app lives in app.extensions and is looked up
+# through current_app.
+db = Database()
+bcrypt = Bcrypt()
+hasher = PasswordHasher(bcrypt)
+error_log = ErrorLog()
+task_cache = TaskCache()
+user_cache = UserCache()
+metrics = Metrics()
@@ -0,0 +1,35 @@
+from flask import Flask
+
+from extensions import bcrypt, db, error_log, hasher, metrics, task_cache, \
+    user_cache
+
+
+def create_app(config=None):
+    """Build the app from _config, with `config` (a dict) overriding it.
+
+    The extension objects are shared, but each keeps what it holds for an
+    app - caches, queues, threads, figures - in app.extensions, so a test
+    or a tool can make one with its own database and nothing leaks between
+    them.
+    """
+    app = Flask(__name__)
+    app.config.from_object('_config')
+    app.config.update(config or {})
+
+    db.init_app(app)
+    bcrypt.init_app(app)
+    hasher.init_app(app)
+    error_log.init_app(app)
+    task_cache.init_app(app)
+    user_cache.init_app(app)
+    metrics.init_app(app)
+
+    # imported here rather than at the top, so that importing the factory
+    # (or the models) doesn't pull in every view
+    from views import main
+    from api import api
+    from export import export
+    app.register_blueprint(main)
+    app.register_blueprint(api)
+    app.register_blueprint(export)
+    return app
@@ -0,0 +1,56 @@
+import os
+import unittest
+
+from factory import create_app
+from extensions import db, task_cache, user_cache
+
+
+# What the test modules share. Each module makes its own app, and each app
+# its own in-memory SQLite database, so no two modules - or two test
+# processes - ever touch the same file, and the suite can be sharded across
+# cores. The extensions keep their caches, queues and figures per app as
+# well (see factory.py), so one module's app never sees another's:
+#
+#   python -m pytest -n auto                      (with pytest-xdist)
+#   ls test*.py | sed 's/.py$//' | xargs -P 4 -n 1 python -m unittest
+#
+# bcrypt runs at its lowest cost; the tests check hashes, not their cost.
+
+TEST_CONFIG = dict(
+    TESTING=True,
+    WTF_CSRF_ENABLED=False,
+    SQLALCHEMY_DATABASE_URI='sqlite://',
+    BCRYPT_LOG_ROUNDS=4,
+    ERROR_LOG_PATH=os.devnull,
+)
+
+
+def create_test_app(**config):
+    """An app with TEST_CONFIG, plus whatever `config` overrides."""
+    settings = dict(TEST_CONFIG)
+    settings.update(config)
+    return create_app(settings)
+
+
+class AppTestCase(unittest.TestCase):
+    """Runs each test in an app context, against freshly created tables.
+
+    Subclasses set `flask_app`; `self.app` is its test client. The tables
+    live in memory, so creating and dropping them per test costs next to
+    nothing, and no test can see another's rows or cached pages.
+    """
+
+    flask_app = None
+
+    def setUp(self):
+        self.context = self.flask_app.app_context()
+        self.context.push()
+        self.app = self.flask_app.test_client()
+        db.create_all()
+        task_cache.backend.clear()
+        user_cache.backend.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
@@ -1,6 +1,8 @@
 from flask_wtf import Form
-from wtforms import StringField, DateField, IntegerField, SelectField, PasswordField
-from wtforms.validators import DataRequired, Length, EqualTo, Email
+from werkzeug.datastructures import MultiDict
+from wtforms import Field, StringField, DateField, IntegerField, SelectField, PasswordField
+from wtforms.validators import DataRequired, Length, EqualTo, Email, \
+    NumberRange, Optional
 
 
 class AddTaskForm(Form):
@@ -8,13 +10,63 @@ class AddTaskForm(Form):
     name = StringField('Task Name', validators=[DataRequired()])
     due_date = DateField('Date Due (mm/dd/yyyy)',
                          validators=[DataRequired()], format='%m/%d/%Y')
-    priority = SelectField('Priority', validators=[DataRequired()],
-                           choices=[('1', '1'), ('2', '2'), ('3', '3'),
-                                    ('4', '4'), ('5', '5'), ('6', '6'),
-                                    ('7', '7'), ('8', '8'), ('9', '9'), ('10', '10')])
+    priority = SelectField('Priority', validators=[DataRequired()], coerce=int,
+                           choices=[(n, str(n)) for n in range(1, 11)])
     status = IntegerField('Status')
 
 
+def validate_task_row(row):
+    """Check one mapping of task fields (eg a CSV or JSON row) against the
+    AddTaskForm rules. Returns the form and a dict of field errors."""
+    formdata = MultiDict((key, u'{0}'.format(value))
+                         for key, value in row.items() if value is not None)
+    form = AddTaskForm(formdata, csrf_enabled=False)
+    form.validate()
+    return form, form.errors
+
+
+class SearchForm(Form):
+    """Filters for the task lists, read from the query string."""
+    q = StringField('Name')
+    priority_min = IntegerField('Priority from',
+                                validators=[Optional(), NumberRange(1, 10)])
+    priority_max = IntegerField('to',
+                                validators=[Optional(), NumberRange(1, 10)])
+    due_from = DateField('Due from', validators=[Optional()],
+                         format='%m/%d/%Y')
+    due_to = DateField('to', validators=[Optional()], format='%m/%d/%Y')
+    owner = StringField('Posted by')
+
+    def filters(self):
+        """The valid, non-empty filters as a dict."""
+        self.validate()
+        return dict((field.name, field.data) for field in self
+                    if field.data and not field.errors)
+
+
+class IntegerListField(Field):
+    """Every value submitted under the field's name, as a list of ints."""
+
+    def _value(self):
+        return u','.join(u'{0}'.format(value) for value in self.data or [])
+
+    def process_formdata(self, valuelist):
+        try:
+            self.data = [int(value) for value in valuelist]
+        except ValueError:
+            self.data = []
+            raise ValueError(self.gettext('Not a valid integer value'))
+
+
+class BulkTaskForm(Form):
+    task_ids = IntegerListField('Tasks', validators=[DataRequired()])
+
+
+class CsrfForm(Form):
+    """Just the CSRF token, for form posts whose data isn't form fields -
+    a CSV upload, say."""
+
+
 class RegisterForm(Form):
     name = StringField('Username', validators=[DataRequired(), Length(min=6, max=25)])
     email = StringField('Email', validators=[DataRequired(), Email(), Length(min=6, max=40)])
@@ -0,0 +1,16 @@
+import multiprocessing
+import os
+
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+#
+# The task pages keep /tasks/events/ open for minutes at a time. A sync
+# worker serves nothing else meanwhile, so the app runs on gevent workers,
+# each holding up to worker_connections requests; events.streaming_enabled
+# only serves the stream where gevent has patched the sockets.
+
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gevent'
+worker_connections = 1000
@@ -0,0 +1,137 @@
+import sys
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from flask import current_app
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool can't take or finish a job in time."""
+
+
+if sys.version_info[0] >= 3:
+    def reraise(exc_info):
+        raise exc_info[1].with_traceback(exc_info[2])
+else:
+    exec('def reraise(exc_info):\n'
+         '    raise exc_info[0], exc_info[1], exc_info[2]\n')
+
+
+class _Job(object):
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        # sys.exc_info() of a failure, so it's raised with the worker's
+        # traceback
+        self.error = None
+        # set once nobody is waiting any more
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            self.result = self.func(*self.args)
+        except Exception:
+            self.error = sys.exc_info()
+        self.done.set()
+
+
+class PasswordHasher(object):
+    """Password hashing and checking at the configured bcrypt cost.
+
+    With BCRYPT_POOL_SIZE = 0 the work is done in the request thread. Above
+    that it runs on that many worker threads (bcrypt releases the GIL), at
+    most BCRYPT_QUEUE_SIZE requests wait for one, and a request that can't
+    be served within BCRYPT_TIMEOUT seconds gets HasherBusy - so a login
+    storm is turned away quickly instead of tying up every worker. Each app
+    has its own pool, in app.extensions['hasher'].
+    """
+
+    def __init__(self, bcrypt, app=None):
+        self.bcrypt = bcrypt
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['hasher'] = HashingPool(
+            app.config.get('BCRYPT_QUEUE_SIZE', 32))
+
+    @property
+    def rounds(self):
+        return current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+
+    def generate(self, password):
+        return self._run(self.bcrypt.generate_password_hash,
+                         password, self.rounds)
+
+    def check(self, pw_hash, password):
+        return self._run(self.bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """True if the hash wasn't made at the configured cost."""
+        return hash_rounds(pw_hash) != self.rounds
+
+    def _run(self, func, *args):
+        config = current_app.config
+        pool_size = config.get('BCRYPT_POOL_SIZE', 0)
+        if not pool_size:
+            return func(*args)
+        return current_app.extensions['hasher'].run(
+            func, args, pool_size, config.get('BCRYPT_TIMEOUT', 5))
+
+
+class HashingPool(object):
+    """One app's queue of hashing jobs and the threads working through it."""
+
+    def __init__(self, queue_size):
+        self._queue = queue.Queue(queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def run(self, func, args, pool_size, timeout):
+        self._start_workers(pool_size)
+        job = _Job(func, args)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise HasherBusy()
+        if not job.done.wait(timeout):
+            # still queued, most likely - don't let it take a worker later
+            job.cancelled = True
+            raise HasherBusy()
+        if job.error is not None:
+            reraise(job.error)
+        return job.result
+
+    def _start_workers(self, pool_size):
+        with self._lock:
+            self._threads = [thread for thread in self._threads
+                             if thread.is_alive()]
+            while len(self._threads) < pool_size:
+                thread = threading.Thread(target=self._work,
+                                          name='password-hasher')
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            self._queue.get().run()
+
+
+def hash_rounds(pw_hash):
+    """The cost a bcrypt hash ($2b$<rounds>$...) was made with."""
+    if isinstance(pw_hash, bytes):
+        pw_hash = pw_hash.decode('utf-8')
+    try:
+        return int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
@@ -0,0 +1,233 @@
+import json
+import os
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, exists, literal, select
+
+from extensions import db
+from models import Job
+
+
+# A job queue in the app's own database, for work that shouldn't hold up a
+# request. enqueue() adds a job to the current transaction - so it's only
+# queued if the write it belongs to commits - and worker.py runs them:
+#
+#   python worker.py [--concurrency 2] [--once]
+#
+# A worker claims a job with a conditional UPDATE, which only one worker
+# can win, and commits before running it. Failed jobs are retried with a
+# doubling delay, JOBS_MAX_ATTEMPTS times in all. Jobs named in
+# JOBS_SCHEDULE queue their next run when they finish, whether they worked
+# or failed for good, and idle workers queue any that have none -
+# schedule_job() only inserts a run if the job has none queued or running,
+# so however many workers try there is only ever one.
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FAILED = 'failed'
+
+# name: handler, filled in by the @job decorator
+HANDLERS = {}
+
+
+def job(name, max_attempts=None):
+    """Register the decorated function as the handler for jobs called
+    `name`. It's called with the job's arguments, in an app context."""
+    def register(func):
+        func.max_attempts = max_attempts
+        HANDLERS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, arguments=None, run_at=None, delay=0):
+    """Queue a job to run at `run_at`, or `delay` seconds from now. Commit
+    the session to send it."""
+    now = datetime.utcnow()
+    queued = Job(name=name, arguments=json.dumps(arguments or {}),
+                 status=QUEUED, attempts=0, created=now,
+                 run_at=run_at or now + timedelta(seconds=delay))
+    db.session.add(queued)
+    return queued
+
+
+def claim_job(worker_id, now=None):
+    """Take the oldest due job, or return None if there isn't one."""
+    now = now or datetime.utcnow()
+    jobs = Job.__table__
+    while True:
+        job_id = db.session.execute(
+            select([jobs.c.id])
+            .where(jobs.c.status == QUEUED).where(jobs.c.run_at <= now)
+            .order_by(jobs.c.run_at, jobs.c.id).limit(1)).scalar()
+        if job_id is None:
+            db.session.commit()
+            return None
+        claimed = db.session.execute(
+            jobs.update()
+            .where(jobs.c.id == job_id).where(jobs.c.status == QUEUED)
+            .values(status=RUNNING, locked_by=worker_id, locked_at=now,
+                    attempts=jobs.c.attempts + 1)).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.query(Job).get(job_id)
+        # another worker got there first
+
+
+def max_attempts(name):
+    handler = HANDLERS.get(name)
+    return getattr(handler, 'max_attempts', None) or \
+        current_app.config['JOBS_MAX_ATTEMPTS']
+
+
+def retry_or_fail(queued, error, now=None):
+    now = now or datetime.utcnow()
+    queued.last_error = error
+    queued.locked_by = queued.locked_at = None
+    if queued.attempts < max_attempts(queued.name):
+        queued.status = QUEUED
+        queued.run_at = now + timedelta(
+            seconds=current_app.config['JOBS_RETRY_DELAY'] *
+            2 ** (queued.attempts - 1))
+    else:
+        queued.status = FAILED
+
+
+def schedule_job(name, delay=0, now=None):
+    """Queue a run of `name` in `delay` seconds unless it already has one
+    queued or running, with a single INSERT ... SELECT ... WHERE NOT EXISTS.
+    True if it was queued. Commit the session to send it."""
+    now = now or datetime.utcnow()
+    jobs = Job.__table__
+    pending = exists().where(and_(jobs.c.name == name,
+                                  jobs.c.status.in_([QUEUED, RUNNING])))
+    return db.session.execute(jobs.insert().from_select(
+        ['name', 'arguments', 'status', 'attempts', 'created', 'run_at'],
+        select([literal(name), literal(json.dumps({})), literal(QUEUED),
+                literal(0), literal(now),
+                literal(now + timedelta(seconds=delay))])
+        .where(~pending))).rowcount == 1
+
+
+def run_job(queued):
+    """Run a claimed job. It's deleted once it succeeds; if it fails it's
+    queued again, or after its last attempt kept as failed. Either way a
+    scheduled job that isn't being retried gets its next run."""
+    job_id, name = queued.id, queued.name
+    try:
+        handler = HANDLERS.get(name)
+        if handler is None:
+            raise LookupError('No handler for jobs called {0}'.format(name))
+        handler(**json.loads(queued.arguments))
+    except Exception:
+        error = traceback.format_exc()
+        db.session.rollback()
+        retry_or_fail(db.session.query(Job).get(job_id), error)
+    else:
+        db.session.query(Job).filter_by(id=job_id).delete()
+    every = dict(current_app.config['JOBS_SCHEDULE']).get(name)
+    if every:
+        # a retry is still queued, so this only adds a run after the last
+        # attempt
+        db.session.flush()
+        schedule_job(name, delay=every)
+    db.session.commit()
+
+
+def requeue_stale(now=None):
+    """Put back the jobs whose worker went quiet (killed, most likely)
+    without finishing them."""
+    now = now or datetime.utcnow()
+    stale = db.session.query(Job).filter(
+        Job.status == RUNNING,
+        Job.locked_at < now - timedelta(
+            seconds=current_app.config['JOBS_LOCK_TIMEOUT'])).all()
+    for queued in stale:
+        retry_or_fail(queued, 'Worker {0} stopped without finishing'
+                      .format(queued.locked_by), now)
+    db.session.commit()
+    return len(stale)
+
+
+def schedule_jobs():
+    """Queue a run of each JOBS_SCHEDULE job that doesn't have one."""
+    for name, every in current_app.config['JOBS_SCHEDULE']:
+        schedule_job(name)
+    db.session.commit()
+
+
+class Worker(object):
+    """Runs queued jobs on `concurrency` threads until stopped."""
+
+    def __init__(self, app, concurrency=None):
+        self.app = app
+        self.concurrency = concurrency or app.config['JOBS_CONCURRENCY']
+        self.stopping = threading.Event()
+        self.name = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+
+    def run_one(self):
+        """Run the next due job, if there is one; True if there was."""
+        queued = claim_job('{0}:{1}'.format(
+            self.name, threading.current_thread().name))
+        if queued is None:
+            return False
+        run_job(queued)
+        return True
+
+    def drain(self):
+        """Run due jobs until there are none left; returns how many ran."""
+        with self.app.app_context():
+            count = 0
+            while self.run_one():
+                count += 1
+            return count
+
+    def start(self):
+        """Get the queue ready: put back any jobs a dead worker left
+        running, and queue any scheduled jobs that aren't."""
+        with self.app.app_context():
+            requeue_stale()
+            schedule_jobs()
+
+    def run(self):
+        self.start()
+        threads = [threading.Thread(target=self._work,
+                                    name='job-worker-{0}'.format(i))
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            # join() with no timeout can't be interrupted by ^C
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        """Finish the jobs in hand, then stop."""
+        self.stopping.set()
+
+    def _work(self):
+        poll = self.app.config['JOBS_POLL']
+        with self.app.app_context():
+            while not self.stopping.is_set():
+                try:
+                    if not self.run_one():
+                        requeue_stale()
+                        schedule_jobs()
+                        self.stopping.wait(poll)
+                except Exception:
+                    # the database went away, most likely - back off
+                    db.session.rollback()
+                    self.app.logger.exception('Job worker error')
+                    self.stopping.wait(poll)
+                finally:
+                    db.session.remove()
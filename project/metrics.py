@@ -0,0 +1,228 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app, g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Per-request instrumentation, off unless METRICS_ENABLED is set. Every
+# request records its wall time, the time spent rendering templates and the
+# number and duration of its SQL statements, aggregated per endpoint into
+# histograms that /metrics/ serves in the Prometheus text format. Figures
+# are per worker process - scrape each worker, or run one.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+HISTOGRAMS = [
+    # name, help, buckets
+    ('flasktaskr_request_seconds', 'Wall time per request', DEFAULT_BUCKETS),
+    ('flasktaskr_template_seconds', 'Time spent rendering templates',
+     DEFAULT_BUCKETS),
+    ('flasktaskr_sql_statements', 'SQL statements per request',
+     STATEMENT_BUCKETS),
+    ('flasktaskr_sql_seconds', 'Time spent in SQL statements',
+     DEFAULT_BUCKETS),
+]
+
+
+class Histogram(object):
+    """Cumulative bucket counts plus sum and count, as Prometheus wants."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class TimedTemplate(Template):
+    """Adds each render's duration to the current request's record."""
+
+    def render(self, *args, **kwargs):
+        record = current_record()
+        if record is None:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        # a template rendered while rendering another is counted once
+        record['rendering'] += 1
+        start = time.time()
+        try:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        finally:
+            record['rendering'] -= 1
+            if not record['rendering']:
+                record['template_seconds'] += time.time() - start
+
+
+def current_record():
+    if not has_request_context():
+        return None
+    return getattr(g, 'metrics', None)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context,
+                    executemany):
+    if current_record() is not None:
+        conn.info.setdefault('metrics_started', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_statement(conn, cursor, statement, parameters, context, executemany):
+    record = current_record()
+    started = conn.info.get('metrics_started')
+    if record is None or not started:
+        return
+    record['sql_statements'] += 1
+    record['sql_seconds'] += time.time() - started.pop()
+
+
+class Metrics(object):
+    """Collects the per-request figures and renders them for /metrics/.
+
+    With METRICS_PROFILE_SAMPLE_RATE above 0 that fraction of requests also
+    runs under cProfile; those that take longer than METRICS_SLOW_REQUEST
+    seconds have their stats written to METRICS_PROFILE_DIR, for pstats or
+    snakeviz.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # each app counts its own requests
+        app.extensions['metrics'] = MetricsState()
+        app.jinja_env.template_class = TimedTemplate
+        app.before_request(self._start)
+        app.after_request(self._status)
+        app.teardown_request(self._finish)
+
+    def _start(self):
+        if not current_app.config.get('METRICS_ENABLED'):
+            return
+        g.metrics = {
+            'started': time.time(),
+            'status': 500,
+            'rendering': 0,
+            'template_seconds': 0.0,
+            'sql_statements': 0,
+            'sql_seconds': 0.0,
+            'profile': None,
+        }
+        if random.random() < current_app.config.get(
+                'METRICS_PROFILE_SAMPLE_RATE', 0):
+            g.metrics['profile'] = cProfile.Profile()
+            g.metrics['profile'].enable()
+
+    def _status(self, response):
+        record = current_record()
+        if record is not None:
+            record['status'] = response.status_code
+        return response
+
+    def _finish(self, exc=None):
+        record = current_record()
+        if record is None:
+            return
+        g.metrics = None
+        elapsed = time.time() - record['started']
+        endpoint = request.endpoint or 'unknown'
+        if record['profile'] is not None:
+            record['profile'].disable()
+            if elapsed >= current_app.config.get('METRICS_SLOW_REQUEST', 1):
+                self._save_profile(record['profile'], endpoint)
+        self.observe(endpoint, record['status'], elapsed,
+                     record['template_seconds'], record['sql_statements'],
+                     record['sql_seconds'])
+
+    def _save_profile(self, profile, endpoint):
+        directory = current_app.config.get('METRICS_PROFILE_DIR', 'profiles')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        profile.dump_stats(os.path.join(directory, '{0}-{1}-{2}.prof'.format(
+            endpoint, int(time.time() * 1000), os.getpid())))
+        self.state.profiles_saved += 1
+
+    @property
+    def state(self):
+        return current_app.extensions['metrics']
+
+    def observe(self, endpoint, status, seconds, template_seconds,
+                sql_statements, sql_seconds):
+        values = (seconds, template_seconds, sql_statements, sql_seconds)
+        state = self.state
+        with state.lock:
+            state.requests[(endpoint, status)] += 1
+            for (name, _, buckets), value in zip(HISTOGRAMS, values):
+                key = (name, endpoint)
+                if key not in state.histograms:
+                    state.histograms[key] = Histogram(buckets)
+                state.histograms[key].observe(value)
+
+    def reset(self):
+        state = self.state
+        with state.lock:
+            state.histograms.clear()
+            state.requests.clear()
+
+    def render(self):
+        """Everything collected so far, in the Prometheus text format."""
+        lines = [
+            '# HELP flasktaskr_requests_total Requests handled',
+            '# TYPE flasktaskr_requests_total counter',
+        ]
+        state = self.state
+        with state.lock:
+            for (endpoint, status), count in sorted(state.requests.items()):
+                lines.append(
+                    'flasktaskr_requests_total{{endpoint="{0}",status="{1}"}}'
+                    ' {2}'.format(endpoint, status, count))
+            for name, help, _ in HISTOGRAMS:
+                lines.append('# HELP {0} {1}'.format(name, help))
+                lines.append('# TYPE {0} histogram'.format(name))
+                for (metric, endpoint), histogram in \
+                        sorted(state.histograms.items()):
+                    if metric != name:
+                        continue
+                    lines.extend(histogram_lines(name, endpoint, histogram))
+        lines.append('# HELP flasktaskr_profiles_saved_total '
+                     'Slow request profiles written')
+        lines.append('# TYPE flasktaskr_profiles_saved_total counter')
+        lines.append('flasktaskr_profiles_saved_total {0}'.format(
+            state.profiles_saved))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsState(object):
+    """One app's figures."""
+
+    def __init__(self):
+        self.profiles_saved = 0
+        self.histograms = {}
+        self.requests = defaultdict(int)
+        self.lock = threading.Lock()
+
+
+def histogram_lines(name, endpoint, histogram):
+    label = 'endpoint="{0}"'.format(endpoint)
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        yield '{0}_bucket{{{1},le="{2}"}} {3}'.format(name, label, bound,
+                                                      count)
+    yield '{0}_bucket{{{1},le="+Inf"}} {2}'.format(name, label,
+                                                   histogram.count)
+    yield '{0}_sum{{{1}}} {2}'.format(name, label, histogram.sum)
+    yield '{0}_count{{{1}}} {2}'.format(name, label, histogram.count)
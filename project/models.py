@@ -1,19 +1,40 @@
-from views import db
+from extensions import db
 import datetime
 
 
+# Task.status - a small integer, compared as one
+CLOSED = 0
+OPEN = 1
+
+
+def utc_today():
+    return datetime.datetime.utcnow().date()
+
+
 # alternative way of creating the database to just using SQL
 # class task defines the tasks table
 class Task(db.Model):
     __tablename__ = 'tasks'
+    # the task lists filter on status and page through (due_date, task_id)
+    __table_args__ = (
+        db.Index('ix_tasks_status_due_date', 'status', 'due_date', 'task_id'),
+        # the archive job looks for tasks closed before a given date
+        db.Index('ix_tasks_status_closed_date', 'status', 'closed_date'),
+        # SQLite would otherwise hand the highest id out again once that
+        # task was archived or deleted - and archived_tasks keeps it
+        {'sqlite_autoincrement': True},
+    )
 
     task_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     due_date = db.Column(db.Date, nullable=False)
     priority = db.Column(db.Integer, nullable=False)
-    posted_date = db.Column(db.Date, default=datetime.datetime.utcnow())
-    status = db.Column(db.Integer)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    posted_date = db.Column(db.Date, default=utc_today)
+    status = db.Column(db.SmallInteger)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    closed_date = db.Column(db.DateTime)
+    # when its owner was sent a due date reminder (see reminders.py)
+    reminded_date = db.Column(db.DateTime)
 
     def __init__(self, name, due_date, priority, posted_date, status, user_id):
         self.name = name
@@ -27,6 +48,29 @@ class Task(db.Model):
         return '<name {0}>'.format(self.name)
 
 
+class ArchivedTask(db.Model):
+    """A closed task moved out of tasks by the archive job (archive.py),
+    under the same task_id."""
+    __tablename__ = 'archived_tasks'
+    __table_args__ = (
+        db.Index('ix_archived_tasks_due_date', 'due_date', 'task_id'),
+    )
+
+    task_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String, nullable=False)
+    due_date = db.Column(db.Date, nullable=False)
+    priority = db.Column(db.Integer, nullable=False)
+    posted_date = db.Column(db.Date)
+    status = db.Column(db.SmallInteger)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    closed_date = db.Column(db.DateTime)
+    archived_date = db.Column(db.DateTime, nullable=False)
+    poster = db.relationship('User')
+
+    def __repr__(self):
+        return '<name {0}>'.format(self.name)
+
+
 class User(db.Model):
     __tablename__ = 'users'
 
@@ -36,6 +80,14 @@ class User(db.Model):
     password = db.Column(db.String, nullable=False)
     tasks = db.relationship('Task', backref='poster')
     role = db.Column(db.String, default='user')
+    # bumped whenever one of the user's tasks changes - the JSON API builds
+    # its ETags and Last-Modified headers from these
+    task_version = db.Column(db.Integer, nullable=False, default=0,
+                             server_default='0')
+    tasks_modified = db.Column(db.DateTime)
+    # stored in the session at login; bumping it ends the user's sessions
+    session_version = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
 
     def __init__(self, name=None, email=None, password=None, role=None):
         self.name = name
@@ -45,3 +97,64 @@ class User(db.Model):
 
     def __repr__(self):
         return 'User {0}>'.format(self.name)
+
+
+class TaskCount(db.Model):
+    """How many tasks a user has at each priority and status. Kept up to
+    date as tasks are written (see counters.py) so the dashboard never has
+    to count the tasks table; db_counts.py rebuilds it from scratch."""
+    __tablename__ = 'task_counts'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+                        primary_key=True, autoincrement=False)
+    priority = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    status = db.Column(db.SmallInteger, primary_key=True,
+                       autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TaskEvent(db.Model):
+    """One change to a task, in the order they were committed. The task
+    pages' event stream (/tasks/events/) reads these by id; see events.py.
+    A task_id of None means too many tasks changed to list one by one."""
+    __tablename__ = 'task_events'
+    # streams resume after the last id they sent, so ids must keep going up
+    # after old events are pruned
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer)
+    action = db.Column(db.String, nullable=False)
+    created = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __init__(self, task_id, action, created=None):
+        self.task_id = task_id
+        self.action = action
+        self.created = created or datetime.datetime.utcnow()
+
+    def __repr__(self):
+        return '<event {0} {1}>'.format(self.action, self.task_id)
+
+
+class Job(db.Model):
+    """A piece of deferred work for worker.py to run - see jobs.py."""
+    __tablename__ = 'jobs'
+    # workers look for the queued jobs that are due, oldest first
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    # the handler's keyword arguments, as JSON
+    arguments = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String, nullable=False, default='queued')
+    run_at = db.Column(db.DateTime, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    locked_by = db.Column(db.String)
+    locked_at = db.Column(db.DateTime)
+    created = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return '<job {0} {1}>'.format(self.name, self.status)
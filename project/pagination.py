@@ -0,0 +1,100 @@
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+# keyset (seek) pagination - instead of OFFSET we remember the sort key of the
+# first/last row on a page and ask for the rows either side of it, so every
+# page costs the same no matter how deep into the table it is
+CURSOR_DATE_FORMAT = '%Y-%m-%d'
+
+
+class Page(object):
+    """One page of rows plus the cursors for the pages either side."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(due_date, row_id):
+    return '{0}_{1}'.format(due_date.strftime(CURSOR_DATE_FORMAT), row_id)
+
+
+def decode_cursor(cursor):
+    """Turn 'yyyy-mm-dd_id' back into (date, id); None if it is malformed."""
+    try:
+        due_date, row_id = cursor.split('_')
+        return datetime.strptime(due_date, CURSOR_DATE_FORMAT).date(), \
+            int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def keyset_paginate(query, date_column, id_column, per_page,
+                    after=None, before=None):
+    """Return a Page of `query` ordered by (date_column, id_column).
+
+    `after` fetches the page following that cursor, `before` the page
+    preceding it. With neither (or a malformed cursor) the first page is
+    returned. One extra row is fetched to find out if there is another page.
+    """
+    key = decode_cursor(before) if before else None
+    backwards = key is not None
+    if not backwards:
+        key = decode_cursor(after) if after else None
+
+    if key is not None:
+        due_date, row_id = key
+        if backwards:
+            query = query.filter(or_(
+                date_column < due_date,
+                and_(date_column == due_date, id_column < row_id)))
+        else:
+            query = query.filter(or_(
+                date_column > due_date,
+                and_(date_column == due_date, id_column > row_id)))
+
+    if backwards:
+        query = query.order_by(date_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(date_column.asc(), id_column.asc())
+
+    rows = query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def cursor_for(row):
+        return encode_cursor(getattr(row, date_column.key),
+                             getattr(row, id_column.key))
+
+    # walking forwards there is an earlier page whenever we started from a
+    # cursor; walking backwards there is always the later page we came from
+    if backwards:
+        has_next, has_prev = True, more
+    else:
+        has_next, has_prev = more, key is not None
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_next:
+            next_cursor = cursor_for(rows[-1])
+        if has_prev:
+            prev_cursor = cursor_for(rows[0])
+    return Page(rows, next_cursor, prev_cursor)
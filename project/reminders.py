@@ -0,0 +1,85 @@
+import logging
+import smtplib
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from email.mime.text import MIMEText
+
+from flask import current_app
+
+from batch import chunks
+from extensions import db
+from jobs import enqueue, job
+from models import OPEN, Task, User
+
+
+# Due date reminders, sent by the job worker. queue_reminders (scheduled
+# in JOBS_SCHEDULE) finds the open tasks due within REMINDER_DAYS that
+# haven't had a reminder and queues one send_reminder job per owner, so a
+# mail server that's down only delays the mail that's waiting on it.
+
+logger = logging.getLogger(__name__)
+
+# with TESTING set, mail is kept here instead of being sent
+outbox = []
+
+
+def send_mail(to, subject, body):
+    """Send a plain text mail through MAIL_SERVER, or log it if there
+    isn't one."""
+    config = current_app.config
+    message = MIMEText(body)
+    message['Subject'] = subject
+    message['From'] = config['MAIL_SENDER']
+    message['To'] = to
+    if current_app.testing:
+        outbox.append(message)
+    elif not config.get('MAIL_SERVER'):
+        logger.info('No MAIL_SERVER - not sending to %s:\n%s', to, body)
+    else:
+        server = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'],
+                              timeout=30)
+        try:
+            server.sendmail(config['MAIL_SENDER'], [to],
+                            message.as_string())
+        finally:
+            server.quit()
+
+
+@job('queue_reminders')
+def queue_reminders(today=None):
+    """Queue reminders for the open tasks due within REMINDER_DAYS, once
+    per task. Returns how many users get one."""
+    due = (today or date.today()) + \
+        timedelta(days=current_app.config['REMINDER_DAYS'])
+    tasks = defaultdict(list)
+    for user_id, task_id in db.session.query(Task.user_id, Task.task_id)\
+            .filter(Task.status == OPEN, Task.due_date <= due,
+                    Task.reminded_date == None):
+        tasks[user_id].append(task_id)
+    now = datetime.utcnow()
+    for user_id, task_ids in tasks.items():
+        enqueue('send_reminder', {'user_id': user_id, 'task_ids': task_ids})
+        for batch in chunks(task_ids, 500):
+            db.session.query(Task).filter(Task.task_id.in_(batch))\
+                .update({Task.reminded_date: now}, synchronize_session=False)
+    db.session.commit()
+    return len(tasks)
+
+
+@job('send_reminder', max_attempts=5)
+def send_reminder(user_id, task_ids):
+    user = db.session.query(User).get(user_id)
+    tasks = []
+    for batch in chunks(task_ids, 500):
+        # some may have been completed or deleted since
+        tasks.extend(db.session.query(Task).filter(Task.task_id.in_(batch),
+                                                   Task.status == OPEN))
+    tasks.sort(key=lambda task: (task.due_date, task.task_id))
+    if user is None or not tasks:
+        return
+    lines = ['Hi {0},'.format(user.name), '',
+             'These tasks of yours are due soon:', '']
+    lines.extend('  {0} - due {1:%m/%d/%Y}'.format(task.name, task.due_date)
+                 for task in tasks)
+    send_mail(user.email, '{0} task(s) due soon'.format(len(tasks)),
+              '\n'.join(lines) + '\n')
@@ -1,4 +1,8 @@
-from views import app
+import os
+
+from factory import create_app
+
+app = create_app()
 port = int(os.environ.get('PORT', 5000))
 app.run(host='0.0.0.0', port=port)
 
@@ -0,0 +1,126 @@
+import re
+import weakref
+
+from sqlalchemy import DDL, column, event, select, text
+
+from flask import current_app
+
+from extensions import db
+from models import Task, User
+
+
+# Task name search. On SQLite the names are indexed in an FTS5 table,
+# tasks_fts, kept in step with tasks by triggers - so rows written through
+# Core (bulk adds, imports) are indexed too - and a search is an index
+# lookup. Other databases, SQLite builds without FTS5, or
+# TASK_SEARCH_FTS = False, fall back to a LIKE '%...%' scan.
+FTS_CREATE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts
+       USING fts5(name, content='tasks', content_rowid='task_id')""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks
+       BEGIN
+         INSERT INTO tasks_fts (rowid, name) VALUES (new.task_id, new.name);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks
+       BEGIN
+         INSERT INTO tasks_fts (tasks_fts, rowid, name)
+         VALUES ('delete', old.task_id, old.name);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_fts_update
+       AFTER UPDATE OF name ON tasks
+       BEGIN
+         INSERT INTO tasks_fts (tasks_fts, rowid, name)
+         VALUES ('delete', old.task_id, old.name);
+         INSERT INTO tasks_fts (rowid, name) VALUES (new.task_id, new.name);
+       END""",
+]
+FTS_REBUILD = "INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')"
+FTS_DROP = "DROP TABLE IF EXISTS tasks_fts"
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# engine: whether its SQLite has FTS5
+_fts5 = weakref.WeakKeyDictionary()
+
+
+def fts5_available(bind):
+    """True if `bind` (an engine or connection) is SQLite built with FTS5."""
+    engine = getattr(bind, 'engine', bind)
+    if engine.dialect.name != 'sqlite':
+        return False
+    if engine not in _fts5:
+        options = [option for option, in
+                   bind.execute(text('PRAGMA compile_options'))]
+        _fts5[engine] = 'ENABLE_FTS5' in options
+    return _fts5[engine]
+
+
+def when_fts5_available(ddl, target, bind, **kw):
+    return fts5_available(bind)
+
+
+for statement in FTS_CREATE:
+    event.listen(Task.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite',
+                                           callable_=when_fts5_available))
+event.listen(Task.__table__, 'before_drop',
+             DDL(FTS_DROP).execute_if(dialect='sqlite'))
+
+
+def create_fts(connection):
+    """Add the index and its triggers to an existing tasks table, if
+    SQLite can have one."""
+    if not fts5_available(connection):
+        return
+    for statement in FTS_CREATE:
+        connection.execute(text(statement))
+    connection.execute(text(FTS_REBUILD))
+
+
+def fts_enabled():
+    return current_app.config.get('TASK_SEARCH_FTS', True) and \
+        fts5_available(db.session.get_bind(Task.__mapper__))
+
+
+def fts_query(words):
+    # every word as a quoted prefix, so "ban" finds "Go to the bank" and
+    # nothing typed in is read as FTS syntax
+    return ' '.join(u'"{0}"*'.format(word) for word in words)
+
+
+def name_matches(search):
+    words = WORD.findall(search)
+    if not words:
+        return None
+    if fts_enabled():
+        fts = text('SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH :query')
+        return Task.task_id.in_(
+            fts.bindparams(query=fts_query(words)).columns(column('rowid')))
+    return Task.name.ilike(u'%{0}%'.format(like_escape(search.strip())),
+                           escape='\\')
+
+
+def like_escape(value):
+    """`value` with LIKE's wildcards taken literally (ESCAPE '\\')."""
+    return value.replace('\\', '\\\\').replace('%', '\\%')\
+        .replace('_', '\\_')
+
+
+def filter_tasks(query, filters):
+    """Narrow a Task query by the values in `filters` (see SearchForm)."""
+    if filters.get('q'):
+        condition = name_matches(filters['q'])
+        if condition is not None:
+            query = query.filter(condition)
+    if filters.get('priority_min'):
+        query = query.filter(Task.priority >= filters['priority_min'])
+    if filters.get('priority_max'):
+        query = query.filter(Task.priority <= filters['priority_max'])
+    if filters.get('due_from'):
+        query = query.filter(Task.due_date >= filters['due_from'])
+    if filters.get('due_to'):
+        query = query.filter(Task.due_date <= filters['due_to'])
+    if filters.get('owner'):
+        query = query.filter(Task.user_id.in_(
+            select([User.id]).where(User.name == filters['owner'])))
+    return query
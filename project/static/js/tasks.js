@@ -0,0 +1,83 @@
+// Keeps the task tables on /tasks/ up to date from /tasks/events/, and
+// sends the add, complete and delete actions without leaving the page -
+// the server answers them with JSON and the change comes back as an event.
+// Without EventSource support, or when the server doesn't stream events (no
+// data-events), everything works as plain links and forms.
+$(function () {
+  var lists = $('#task-lists');
+  if (!lists.length || !lists.data('events') || !window.EventSource) {
+    return;
+  }
+
+  // 'yyyy-mm-dd_id' keys, in the order the lists are sorted
+  function compareKeys(a, b) {
+    a = a.split('_');
+    b = b.split('_');
+    if (a[0] !== b[0]) {
+      return a[0] < b[0] ? -1 : 1;
+    }
+    return parseInt(a[1], 10) - parseInt(b[1], 10);
+  }
+
+  // put the row where it sorts, unless that's on another page
+  function insertRow(list, key, html) {
+    var table = lists.find('table[data-list="' + list + '"]');
+    var rows = table.find('tbody tr');
+    var row = $($.trim(html));
+    var next = rows.filter(function () {
+      return compareKeys(key, String($(this).data('key'))) < 0;
+    }).first();
+    if (next.length) {
+      if (next.is(rows.first()) && table.data('prev')) {
+        return;
+      }
+      next.before(row);
+    } else if (!table.data('next')) {
+      table.find('tbody').append(row);
+    }
+  }
+
+  function reloadTables() {
+    $.get(window.location.href, function (page) {
+      lists.html($(page).find('#task-lists').html());
+    });
+  }
+
+  var source = new EventSource(lists.data('events'));
+  source.onmessage = function (message) {
+    var event = JSON.parse(message.data);
+    if (event.action === 'reload') {
+      reloadTables();
+      return;
+    }
+    lists.find('tr[data-task-id="' + event.task_id + '"]').remove();
+    if (event.html) {
+      insertRow(event.list, event.key, event.html);
+    }
+  };
+
+  lists.on('click', 'a[data-action]', function (e) {
+    var href = this.href;
+    e.preventDefault();
+    $.ajax({url: href, dataType: 'json'}).fail(function () {
+      // let the page show what went wrong
+      window.location = href;
+    });
+  });
+
+  $('#add-task').on('submit', function (e) {
+    var form = this;
+    e.preventDefault();
+    $.ajax({
+      url: form.action,
+      type: 'POST',
+      data: $(form).serialize(),
+      dataType: 'json'
+    }).done(function () {
+      form.reset();
+    }).fail(function () {
+      // post it the old way, for the form to come back with its errors
+      form.submit();
+    });
+  });
+});
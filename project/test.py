@@ -1,29 +1,38 @@
+import json
 import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import traceback
 import unittest
+from datetime import date, datetime, timedelta
+from io import BytesIO
 
-from views import app, db
-from _config import basedir
-from models import User
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 
-from views import bcrypt
+from fixtures import AppTestCase, create_test_app
+from extensions import db, bcrypt, hasher, task_cache
+from models import OPEN, ArchivedTask, Task, TaskEvent, User, utc_today
 
+from views import set_role
+from hashing import HasherBusy, HashingPool, hash_rounds
+from counters import count_changes, differences, rebuild_counts
+from archive import archive_closed_tasks
+from events import prune_events, streaming_enabled
+from batch import JSONRowReader
+import search
 
-TEST_DB = 'test.db'
 
+# one process, so the per process cache is safe here
+app = create_test_app(TASK_CACHE_BACKEND='lru', TASK_EVENTS_ENABLED=True)
 
-class AllTests(unittest.TestCase):
 
-    def setUp(self):
-        app.config['TESTING'] = True
-        app.config['WTF_CSRF_ENABLED'] = False
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' +\
-            os.path.join(basedir, TEST_DB)
-        self.app = app.test_client()
-        db.create_all()
+class AllTests(AppTestCase):
 
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
+    flask_app = app
 
     def test_user_setup(self):
         new_user = User('stevejg', 'stevejg@hotmail.com', 'stevejg')
@@ -159,6 +168,275 @@ class AllTests(unittest.TestCase):
         response = self.app.get("delete/1/", follow_redirects=True)
         self.assertIn(b'You can only delete tasks that belong to you', response.data)
 
+    def test_completing_a_missing_task_is_not_an_error(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        response = self.app.get("complete/99/", follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'That task does not exist', response.data)
+
+    def test_deleting_a_missing_task_is_not_an_error(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        response = self.app.get("delete/99/", follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'That task does not exist', response.data)
+
+    def test_users_can_complete_many_tasks(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        for _ in range(3):
+            self.create_task()
+        response = self.app.post('complete/', data=dict(task_ids=['1', '3']),
+                                 follow_redirects=True)
+        self.assertIn(b'2 task(s) marked as complete', response.data)
+        self.assertEqual(db.session.query(Task).filter_by(status=1).count(), 1)
+
+    def test_bulk_delete_skips_tasks_not_created_by_user(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.create_task()
+        self.logout()
+        self.create_user('fletcher', 'fletcher@realpython.com', 'python101')
+        self.login('fletcher', 'python101')
+        self.create_task()
+        response = self.app.post('delete/', data=json.dumps({'task_ids': [1, 2]}),
+                                 content_type='application/json')
+        self.assertEqual(json.loads(response.data)['deleted'], 1)
+        self.assertEqual(db.session.query(Task).count(), 1)
+
+    def test_users_can_add_many_tasks(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        tasks = [dict(name='Task {0}'.format(i), due_date='02/05/2015',
+                      priority=i) for i in range(1, 4)]
+        response = self.app.post('add/bulk/', data=json.dumps(tasks),
+                                 content_type='application/json')
+        self.assertEqual(json.loads(response.data)['added'], 3)
+        self.assertEqual(db.session.query(Task).count(), 3)
+
+    def test_tasks_are_stored_with_typed_columns(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.create_task()
+        db.session.execute(Task.__table__.insert(), [
+            dict(name='Later', due_date=date(2015, 2, 5), priority=2,
+                 status=OPEN, user_id=1)])
+        db.session.commit()
+        self.assertEqual(db.session.execute(
+            'SELECT typeof(status), typeof(priority) FROM tasks').fetchall(),
+            [('integer', 'integer')] * 2)
+        self.assertEqual(
+            [task.posted_date for task in db.session.query(Task)],
+            [utc_today()] * 2)
+
+    def test_bulk_add_is_all_or_nothing(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        csv_body = ('name,due_date,priority\n'
+                    'Go to the bank,02/05/2015,1\n'
+                    'Go to the shop,not a date,11\n')
+        response = self.app.post('add/bulk/', data=csv_body,
+                                 content_type='text/csv',
+                                 headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 400)
+        errors = json.loads(response.data)['errors']
+        self.assertEqual(errors[0]['row'], 2)
+        self.assertIn('due_date', errors[0]['errors'])
+        self.assertIn('priority', errors[0]['errors'])
+        self.assertEqual(db.session.query(Task).count(), 0)
+
+    def csrf_token(self):
+        return re.search(r'name="csrf_token" type="hidden" value="([^"]+)"',
+                         self.app.get('tasks/').data.decode()).group(1)
+
+    def test_form_posts_need_a_csrf_token(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.create_task()
+        upload = 'name,due_date,priority\nGo to the shop,02/05/2015,1\n'
+        app.config['WTF_CSRF_ENABLED'] = True
+        try:
+            response = self.app.post('add/bulk/', data=dict(
+                file=(BytesIO(upload.encode()), 'tasks.csv')),
+                headers={'Accept': 'application/json'})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(b'reload the page', response.data)
+            response = self.app.post('complete/', data=dict(task_ids=[1]),
+                                     headers={'Accept': 'application/json'})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(b'reload the page', response.data)
+            self.assertEqual(db.session.query(Task).get(1).status, OPEN)
+            self.assertEqual(db.session.query(Task).count(), 1)
+            response = self.app.post('add/bulk/', data=dict(
+                file=(BytesIO(upload.encode()), 'tasks.csv'),
+                csrf_token=self.csrf_token()),
+                headers={'Accept': 'application/json'})
+            self.assertEqual(response.status_code, 200)
+            # a browser won't send JSON to another site without asking it
+            response = self.app.post('add/bulk/', data=json.dumps([
+                {'name': 'Bulk', 'due_date': '02/05/2015', 'priority': '1'}]),
+                content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            response = self.app.post('complete/', data=json.dumps(
+                {'task_ids': [1]}), content_type='application/json')
+            self.assertEqual(json.loads(response.data)['updated'], 1)
+            response = self.app.post('delete/', data=json.dumps(
+                {'task_ids': [1]}), content_type='application/json')
+            self.assertEqual(json.loads(response.data)['deleted'], 1)
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
+        self.assertEqual(db.session.query(Task).count(), 2)
+
+    def test_import_skips_invalid_rows(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        rows = [dict(name='Task {0}'.format(i), due_date='02/05/2015',
+                     priority=str(1 + i % 10)) for i in range(5)]
+        rows[1]['priority'] = '11'
+        rows[3]['due_date'] = '2015-02-05'
+        app.config['IMPORT_BATCH_SIZE'] = 2
+        try:
+            response = self.app.post('import/', data=json.dumps(rows),
+                                     content_type='application/json')
+        finally:
+            app.config['IMPORT_BATCH_SIZE'] = 1000
+        result = json.loads(response.data)
+        self.assertEqual(result['imported'], 3)
+        self.assertEqual([error['row'] for error in result['errors']], [2, 4])
+        self.assertEqual([task.name for task in
+                          db.session.query(Task).order_by(Task.task_id)],
+                         ['Task 0', 'Task 2', 'Task 4'])
+
+    def test_json_rows_are_read_as_they_arrive(self):
+        body = json.dumps({'source': {'rows': [1, 2]}, 'tasks': [
+            {'name': u'Caf\xe9 {0}'.format(i), 'priority': 10 ** i}
+            for i in range(3)]}).encode('utf-8')
+        self.assertEqual(
+            [(row['name'], row['priority']) for row in
+             JSONRowReader(BytesIO(body), chunk_size=3).rows()],
+            [(u'Caf\xe9 0', 1), (u'Caf\xe9 1', 10), (u'Caf\xe9 2', 100)])
+        with self.assertRaises(ValueError):
+            list(JSONRowReader(BytesIO(b'[{"name": "a"}, {"na'),
+                               chunk_size=3).rows())
+        with self.assertRaises(ValueError):
+            list(JSONRowReader(BytesIO(b'[{"name": "' + b'a' * 20 + b'"}]'),
+                               chunk_size=3, max_row_length=10).rows())
+
+    def test_import_reports_where_bad_json_stopped_it(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        app.config['IMPORT_BATCH_SIZE'] = 1
+        try:
+            response = self.app.post(
+                'import/', data='[{"name": "Go to the bank", "priority": 1, '
+                '"due_date": "02/05/2015"}, {"name": ',
+                content_type='application/json')
+        finally:
+            app.config['IMPORT_BATCH_SIZE'] = 1000
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['imported'], 1)
+        self.assertEqual(db.session.query(Task).count(), 1)
+
+    def test_imports_from_forms_need_a_csrf_token(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        upload = 'name,due_date,priority\nGo to the shop,02/05/2015,1\n'
+        app.config['WTF_CSRF_ENABLED'] = True
+        try:
+            response = self.app.post('import/', data=dict(
+                file=(BytesIO(upload.encode()), 'tasks.csv')),
+                headers={'Accept': 'application/json'})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(b'reload the page', response.data)
+            self.assertEqual(db.session.query(Task).count(), 0)
+            response = self.app.post('import/', data=dict(
+                file=(BytesIO(upload.encode()), 'tasks.csv'),
+                csrf_token=self.csrf_token()),
+                headers={'Accept': 'application/json'})
+            self.assertEqual(json.loads(response.data)['imported'], 1)
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
+
+    def test_login_upgrades_password_hash_cost(self):
+        db.session.add(User('michael', 'michael@realpython.com',
+                            bcrypt.generate_password_hash('python', 4)))
+        db.session.commit()
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        try:
+            response = self.login('michael', 'python')
+        finally:
+            app.config['BCRYPT_LOG_ROUNDS'] = 4
+        self.assertIn(b'Welcome', response.data)
+        user = db.session.query(User).filter_by(name='michael').one()
+        self.assertEqual(hash_rounds(user.password), 5)
+        self.assertTrue(bcrypt.check_password_hash(user.password, 'python'))
+
+    def test_hashing_can_run_on_a_pool(self):
+        app.config['BCRYPT_POOL_SIZE'] = 2
+        try:
+            self.register('michael', 'michael@realpython.com', 'python', 'python')
+            response = self.login('michael', 'python')
+        finally:
+            app.config['BCRYPT_POOL_SIZE'] = 0
+        self.assertIn(b'Welcome', response.data)
+
+    def test_a_busy_pool_skips_the_rehash_not_the_login(self):
+        db.session.add(User('michael', 'michael@realpython.com',
+                            bcrypt.generate_password_hash('python', 5)))
+        db.session.commit()
+
+        def busy(password):
+            raise HasherBusy()
+        hasher.generate = busy
+        try:
+            response = self.login('michael', 'python')
+        finally:
+            del hasher.generate
+        self.assertIn(b'Welcome', response.data)
+        user = db.session.query(User).filter_by(name='michael').one()
+        self.assertEqual(hash_rounds(user.password), 5)
+
+    def test_jobs_given_up_on_are_not_run(self):
+        pool = HashingPool(4)
+        started, release, ran = threading.Event(), threading.Event(), []
+
+        def hold():
+            started.set()
+            release.wait(5)
+        # the one worker is held up, so the next job times out queued
+        threading.Thread(target=pool.run, args=(hold, (), 1, 10)).start()
+        started.wait(5)
+        with self.assertRaises(HasherBusy):
+            pool.run(ran.append, ('late',), 1, 0.05)
+        release.set()
+        self.assertEqual(pool.run(ran.append, ('next',), 1, 5), None)
+        self.assertEqual(ran, ['next'])
+
+    def test_hashing_errors_keep_their_traceback(self):
+        pool = HashingPool(4)
+
+        def fail():
+            raise ValueError('bad hash')
+        try:
+            pool.run(fail, (), 1, 5)
+        except ValueError:
+            frames = traceback.extract_tb(sys.exc_info()[2])
+        self.assertEqual(frames[-1][2], 'fail')
+
+    def test_task_tables_are_cached_until_tasks_change(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.create_task()
+        hits = task_cache.stats()['hits']
+        self.app.get('tasks/')
+        response = self.app.get('tasks/')
+        self.assertEqual(task_cache.stats()['hits'], hits + 4)
+        self.assertIn(b'complete/1/', response.data)
+        self.app.get('complete/1/')
+        response = self.app.get('tasks/')
+        self.assertNotIn(b'complete/1/', response.data)
+
     def test_default_user_role(self):
         db.session.add(User("Johnny", "john@doe.com", "johnny"))
         db.session.commit()
@@ -249,6 +527,499 @@ class AllTests(unittest.TestCase):
         self.assertIn(b'complete/2/', response.data)
         self.assertIn(b'delete/2/', response.data)
 
+    def test_task_lists_are_paginated(self):
+        app.config['TASKS_PER_PAGE'] = 2
+        try:
+            self.create_user('michael', 'michael@realpython', 'python')
+            self.login('michael', 'python')
+            for _ in range(3):
+                self.create_task()
+            response = self.app.get('tasks/')
+            self.assertIn(b'complete/2/', response.data)
+            self.assertNotIn(b'complete/3/', response.data)
+            self.assertIn(b'open_after=2015-02-05_2', response.data)
+            response = self.app.get('tasks/?open_after=2015-02-05_2')
+            self.assertIn(b'complete/3/', response.data)
+            self.assertNotIn(b'complete/2/', response.data)
+            self.assertIn(b'open_before=2015-02-05_3', response.data)
+            response = self.app.get('tasks/?open_before=2015-02-05_3')
+            self.assertIn(b'complete/1/', response.data)
+            self.assertIn(b'complete/2/', response.data)
+            self.assertNotIn(b'open_before', response.data)
+        finally:
+            app.config['TASKS_PER_PAGE'] = 25
+
+    def add_named_tasks(self, *names):
+        user = db.session.query(User).first()
+        for priority, name in enumerate(names, 1):
+            db.session.add(Task(name, date(2015, 2, priority), priority,
+                                date(2015, 2, 1), 1, user.id))
+        db.session.commit()
+
+    def test_tasks_can_be_searched_by_name(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.add_named_tasks('Go to the bank', 'Buy milk', 'Bank holiday')
+        response = self.app.get('tasks/?q=ban')
+        self.assertIn(b'Go to the bank', response.data)
+        self.assertIn(b'Bank holiday', response.data)
+        self.assertNotIn(b'Buy milk', response.data)
+        # renamed and deleted tasks drop out of the index
+        task = db.session.query(Task).filter_by(name='Bank holiday').one()
+        task.name = 'Holiday'
+        db.session.query(Task).filter_by(name='Go to the bank').delete()
+        db.session.commit()
+        task_cache.backend.clear()
+        response = self.app.get('tasks/?q=bank')
+        self.assertNotIn(b'Holiday', response.data)
+        self.assertNotIn(b'Go to the bank', response.data)
+
+    def test_name_search_falls_back_to_like(self):
+        app.config['TASK_SEARCH_FTS'] = False
+        try:
+            self.create_user('michael', 'michael@realpython', 'python')
+            self.login('michael', 'python')
+            self.add_named_tasks('Go to the bank', 'Buy milk')
+            response = self.app.get('tasks/?q=o to')
+            self.assertIn(b'Go to the bank', response.data)
+            self.assertNotIn(b'Buy milk', response.data)
+        finally:
+            app.config['TASK_SEARCH_FTS'] = True
+
+    def test_like_search_takes_wildcards_literally(self):
+        app.config['TASK_SEARCH_FTS'] = False
+        try:
+            self.create_user('michael', 'michael@realpython', 'python')
+            self.login('michael', 'python')
+            self.add_named_tasks('Rename a_b', 'Rename axb')
+            response = self.app.get('tasks/?q=a_b')
+            self.assertIn(b'Rename a_b', response.data)
+            self.assertNotIn(b'Rename axb', response.data)
+        finally:
+            app.config['TASK_SEARCH_FTS'] = True
+
+    def test_search_works_without_fts5(self):
+        plain_app = create_test_app()
+        db.session.remove()
+        with plain_app.app_context():
+            # as if SQLite had been built without FTS5
+            search._fts5[db.engine] = False
+            db.create_all()
+            self.assertFalse(db.engine.dialect.has_table(db.engine,
+                                                         'tasks_fts'))
+            db.session.add(User('michael', 'michael@realpython', 'python'))
+            self.add_named_tasks('Go to the bank', 'Buy milk')
+            self.assertEqual([task.name for task in search.filter_tasks(
+                db.session.query(Task), {'q': 'bank'})], ['Go to the bank'])
+            db.session.remove()
+
+    def test_tasks_can_be_filtered(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.add_named_tasks('One', 'Two', 'Three', 'Four')
+        response = self.app.get('tasks/?priority_min=2&priority_max=3')
+        self.assertIn(b'Two', response.data)
+        self.assertIn(b'Three', response.data)
+        self.assertNotIn(b'Four', response.data)
+        response = self.app.get('tasks/?due_from=02/04/2015&owner=michael')
+        self.assertIn(b'Four', response.data)
+        self.assertNotIn(b'Three', response.data)
+        response = self.app.get('tasks/?owner=nobody')
+        self.assertNotIn(b'Four', response.data)
+        # a bad filter is reported and ignored
+        response = self.app.get('tasks/?priority_min=11')
+        self.assertIn(b'Number must be between 1 and 10', response.data)
+        self.assertIn(b'One', response.data)
+
+    def test_page_links_keep_the_filters(self):
+        app.config['TASKS_PER_PAGE'] = 1
+        try:
+            self.create_user('michael', 'michael@realpython', 'python')
+            self.login('michael', 'python')
+            self.add_named_tasks('One', 'Two', 'Three')
+            response = self.app.get('tasks/?priority_min=2')
+            self.assertIn(b'priority_min=2', response.data)
+            self.assertIn(b'open_after=2015-02-02_2', response.data)
+        finally:
+            app.config['TASKS_PER_PAGE'] = 25
+
+    def dashboard(self):
+        response = self.app.get('dashboard/', headers=dict(
+            Accept='application/json'))
+        return json.loads(response.data)['users']
+
+    def test_dashboard_counts_follow_task_changes(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        for _ in range(4):
+            self.create_task()
+        self.app.post('add/bulk/', content_type='application/json',
+                      data=json.dumps([dict(name='Later', due_date='01/01/2100',
+                                            priority='3')]))
+        self.app.get('complete/1/')
+        self.app.get('complete/1/')
+        self.app.get('delete/2/')
+        self.app.post('complete/', data=dict(task_ids=['3']))
+        self.app.post('delete/', data=dict(task_ids=['1']))
+        user, = self.dashboard()
+        self.assertEqual((user['open'], user['closed'], user['overdue']),
+                         (2, 1, 1))
+        self.assertEqual(user['priorities'], {
+            '1': dict(open=1, closed=1, overdue=1),
+            '3': dict(open=1, closed=0, overdue=0)})
+        connection = db.engine.connect()
+        try:
+            self.assertEqual(differences(connection), {})
+        finally:
+            connection.close()
+
+    def test_counted_tasks_stay_locked_until_commit(self):
+        directory = tempfile.mkdtemp()
+        file_app = create_test_app(
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(
+                directory, 'locks.db'),
+            SQLITE_BUSY_TIMEOUT=0)
+        # the session is per thread, not per app
+        db.session.remove()
+        try:
+            with file_app.app_context():
+                db.create_all()
+                count_changes(db.session.query(Task))
+                other = db.engine.connect()
+                try:
+                    with self.assertRaises(OperationalError):
+                        other.execute(Task.__table__.insert(), name='Other',
+                                      due_date=date(2015, 2, 5), priority=1,
+                                      status=OPEN)
+                finally:
+                    other.close()
+                db.session.remove()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_dashboard_counts_can_be_rebuilt(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        # written behind the counters' back
+        self.add_tasks_for_new_users(0, 3)
+        connection = db.engine.connect()
+        try:
+            self.assertEqual(len(differences(connection)), 3)
+            rebuild_counts(connection)
+            self.assertEqual(differences(connection), {})
+        finally:
+            connection.close()
+
+    def test_users_only_see_their_own_summary(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.create_admin_user()
+        self.login('michael', 'python')
+        self.assertEqual([user['name'] for user in self.dashboard()],
+                         ['michael'])
+        self.logout()
+        self.login('administrator', 'administrator')
+        self.assertEqual([user['name'] for user in self.dashboard()],
+                         ['administrator', 'michael'])
+        self.assertIn(b'<td><strong>michael</strong></td>',
+                      self.app.get('dashboard/').data)
+
+    def test_session_holds_only_user_id_and_version(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        with self.app.session_transaction() as session:
+            self.assertEqual(sorted(session.keys()), ['uid', 'ver'])
+
+    def test_logged_in_user_is_cached(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.app.get('tasks/')
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db.get_engine(app)
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            self.app.get('tasks/')
+        finally:
+            event.remove(engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        self.assertFalse([statement for statement in statements
+                          if 'users.session_version' in statement])
+
+    def test_role_change_ends_sessions(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        user = db.session.query(User).filter_by(name='michael').one()
+        set_role(user.id, 'admin')
+        db.session.commit()
+        response = self.app.get('tasks/', follow_redirects=True)
+        self.assertIn(b'You need to login first', response.data)
+        self.login('michael', 'python')
+        response = self.app.get('dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.app.get('cache/stats/').status_code, 200)
+
+    def close_tasks(self, days_ago, *task_ids):
+        db.session.query(Task).filter(Task.task_id.in_(task_ids)).update({
+            Task.status: 0,
+            Task.closed_date: datetime.utcnow() - timedelta(days=days_ago)
+        }, synchronize_session=False)
+        db.session.commit()
+
+    def test_completed_tasks_record_when_they_were_closed(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.create_task()
+        self.app.get('complete/1/')
+        task = db.session.query(Task).get(1)
+        self.assertTrue(datetime.utcnow() - task.closed_date <
+                        timedelta(minutes=1))
+
+    def test_completing_a_closed_task_changes_nothing(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.create_task()
+        self.app.get('complete/1/')
+        closed_date = datetime.utcnow() - timedelta(days=3)
+        db.session.query(Task).update({Task.closed_date: closed_date})
+        db.session.commit()
+        response = self.app.get('complete/1/', follow_redirects=True)
+        self.assertIn(b'task was already complete', response.data)
+        self.assertEqual(db.session.query(Task).get(1).closed_date,
+                         closed_date)
+        self.assertEqual(db.session.query(TaskEvent)
+                         .filter_by(action='completed').count(), 1)
+
+    def test_old_closed_tasks_are_archived(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.add_named_tasks('Recent', 'Old one', 'Old two', 'Old three')
+        self.close_tasks(1, 1)
+        self.close_tasks(60, 2, 3, 4)
+        rebuild_counts(db.session.connection())
+        db.session.commit()
+        task_cache.backend.clear()
+        response = self.app.get('tasks/')
+        self.assertIn(b'Recent', response.data)
+        self.assertNotIn(b'Old one', response.data)
+
+        self.assertEqual(archive_closed_tasks(batch_size=2), 3)
+        self.assertEqual([task.task_id for task in db.session.query(Task)],
+                         [1])
+        self.assertEqual(archive_closed_tasks(), 0)
+        connection = db.engine.connect()
+        try:
+            self.assertEqual(differences(connection), {})
+        finally:
+            connection.close()
+
+        app.config['TASKS_PER_PAGE'] = 2
+        try:
+            response = self.app.get('archive/')
+        finally:
+            app.config['TASKS_PER_PAGE'] = 25
+        self.assertIn(b'Old one', response.data)
+        self.assertIn(b'Old two', response.data)
+        self.assertNotIn(b'Old three', response.data)
+        self.assertIn(b'/archive/?archived_after=2015-02-03_3', response.data)
+
+    def test_archived_task_ids_are_not_reused(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.add_named_tasks('First')
+        self.close_tasks(60, 1)
+        self.assertEqual(archive_closed_tasks(), 1)
+        self.add_named_tasks('Second')
+        second = db.session.query(Task.task_id).filter_by(
+            name='Second').scalar()
+        self.assertNotEqual(second, 1)
+        self.close_tasks(60, second)
+        self.assertEqual(archive_closed_tasks(), 1)
+        self.assertEqual(
+            sorted(task.name for task in db.session.query(ArchivedTask)),
+            ['First', 'Second'])
+
+    def count_queries(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db.get_engine(app)
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            self.app.get(url)
+        finally:
+            event.remove(engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return len(statements)
+
+    def add_tasks_for_new_users(self, start, stop):
+        for i in range(start, stop):
+            user = User('user{0}'.format(i), 'user{0}@realpython.com'.format(i),
+                        'python')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Task('Task {0}'.format(i), date(2015, 2, 5), 1,
+                                date(2015, 2, 4), i % 2, user.id))
+        db.session.commit()
+
+    def test_task_page_query_count_does_not_grow_with_tasks(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.add_tasks_for_new_users(0, 2)
+        few = self.count_queries('tasks/')
+        self.add_tasks_for_new_users(2, 12)
+        db.session.remove()
+        many = self.count_queries('tasks/')
+        self.assertEqual(few, many)
+
+    def test_only_admins_can_export_tasks(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        response = self.app.get('export/tasks.csv')
+        self.assertEqual(response.status_code, 403)
+
+    def test_admins_can_export_filtered_tasks(self):
+        self.create_admin_user()
+        self.login('administrator', 'administrator')
+        self.add_tasks_for_new_users(0, 4)
+        response = self.app.get('export/tasks.csv?status=closed')
+        lines = response.data.splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['task_id', 'name'])
+        self.assertEqual([line.split(',')[1] for line in lines[1:]],
+                         ['Task 0', 'Task 2'])
+        self.assertEqual([line.split(',')[5] for line in lines[1:]],
+                         ['closed', 'closed'])
+        response = self.app.get('export/tasks.ndjson?owner=3')
+        rows = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual([row['poster'] for row in rows], ['user1'])
+        self.assertEqual(rows[0]['due_date'], '2015-02-05')
+        response = self.app.get('export/tasks.csv?due_from=soon')
+        self.assertEqual(response.status_code, 400)
+
+    def stream_events(self, url, **headers):
+        # one poll, then the stream ends
+        app.config['TASK_EVENTS_TIMEOUT'] = 0
+        try:
+            response = self.app.get(url, headers=headers)
+            lines = response.data.splitlines()
+        finally:
+            app.config['TASK_EVENTS_TIMEOUT'] = 300
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        return [json.loads(line[len('data: '):]) for line in lines
+                if line.startswith('data: ')]
+
+    def test_task_changes_are_logged_as_events(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.create_task()
+        self.create_task()
+        self.app.get('complete/1/')
+        self.app.get('delete/2/')
+        self.app.post('add/bulk/', data=json.dumps([
+            {'name': 'Bulk', 'due_date': '02/05/2015', 'priority': '1'}]),
+            content_type='application/json')
+        self.assertEqual(
+            [(event.task_id, event.action) for event in
+             db.session.query(TaskEvent).order_by(TaskEvent.id)],
+            [(1, 'added'), (2, 'added'), (1, 'completed'), (2, 'deleted'),
+             (None, 'reload')])
+
+    def test_event_stream_sends_changed_rows(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.create_task()
+        self.create_task()
+        self.app.get('complete/1/')
+        self.app.get('delete/2/')
+        events = self.stream_events('tasks/events/?after=0')
+        self.assertEqual([(event['task_id'], event['action'])
+                          for event in events],
+                         [(1, 'added'), (2, 'added'), (1, 'completed'),
+                          (2, 'deleted')])
+        # each row as it is now: task 1 is closed, task 2 gone
+        self.assertEqual(events[0]['list'], 'closed')
+        self.assertEqual(events[0]['key'], '2015-02-05_1')
+        self.assertIn('Go to the bank', events[0]['html'])
+        self.assertNotIn('Mark as Complete', events[0]['html'])
+        self.assertNotIn('html', events[1])
+
+    def test_event_stream_resumes_after_last_event_id(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.create_task()
+        self.create_task()
+        events = self.stream_events('tasks/events/?after=0',
+                                    **{'Last-Event-ID': '1'})
+        self.assertEqual([event['task_id'] for event in events], [2])
+        # a new stream starts from the latest event
+        self.assertEqual(self.stream_events('tasks/events/'), [])
+
+    def test_event_ids_keep_going_up_after_a_prune(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.create_task()
+        self.create_task()
+        self.assertEqual(prune_events(datetime.utcnow() + timedelta(1)), 2)
+        self.create_task()
+        self.assertEqual(db.session.query(TaskEvent.id).scalar(), 3)
+
+    def test_sync_workers_do_not_stream_events(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        app.config['TASK_EVENTS_ENABLED'] = None
+        try:
+            # no gevent patching in the tests: as under sync workers
+            self.assertFalse(streaming_enabled())
+            response = self.app.get('tasks/')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(b'data-events', response.data)
+            self.assertEqual(self.app.get('tasks/events/').status_code, 204)
+        finally:
+            app.config['TASK_EVENTS_ENABLED'] = True
+
+    def test_event_stream_leaves_out_rows_the_filters_hide(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.create_task()
+        events = self.stream_events('tasks/events/?after=0&q=zoo')
+        self.assertEqual(events[0]['action'], 'added')
+        self.assertNotIn('html', events[0])
+        events = self.stream_events('tasks/events/?after=0&q=bank')
+        self.assertEqual(events[0]['list'], 'open')
+
+    def test_task_actions_answer_json_when_asked(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        response = self.app.post('add/', data=dict(
+            name='Go to the bank', due_date='02/05/2015', priority='1'),
+            headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.data)['task_id'], 1)
+        response = self.app.post('add/', data=dict(name='x'),
+                                 headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('due_date', json.loads(response.data)['errors'])
+        response = self.app.get('complete/1/',
+                                headers={'Accept': 'application/json'})
+        self.assertEqual(json.loads(response.data)['message'],
+                         'task was marked as complete')
+        response = self.app.get('delete/5/',
+                                headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_task_page_links_to_its_event_stream(self):
+        self.create_user('michael', 'michael@realpython', 'python')
+        self.login('michael', 'python')
+        self.create_task()
+        response = self.app.get('tasks/?q=bank')
+        self.assertIn(b'data-events="/tasks/events/?', response.data)
+        self.assertIn(b'after=1', response.data)
+        self.assertIn(b'data-key="2015-02-05_1"', response.data)
+
 
 if __name__ == '__main__':
     unittest.main()
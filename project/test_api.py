@@ -0,0 +1,104 @@
+import json
+import unittest
+
+from fixtures import AppTestCase, create_test_app
+from extensions import db
+from models import Task, User
+
+from extensions import bcrypt
+
+
+app = create_test_app()
+
+
+class ApiTests(AppTestCase):
+
+    flask_app = app
+
+    # helper methods
+    def create_user(self, name, password):
+        new_user = User(name=name, email=name + '@realpython.com',
+                        password=bcrypt.generate_password_hash(password))
+        db.session.add(new_user)
+        db.session.commit()
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(name=name, password=password),
+                             follow_redirects=True)
+
+    def post_task(self, name='Go to the bank'):
+        return self.app.post('/api/v1/tasks/', content_type='application/json',
+                             data=json.dumps(dict(name=name,
+                                                  due_date='02/05/2015',
+                                                  priority='1')))
+
+    def test_api_requires_login(self):
+        response = self.app.get('/api/v1/tasks/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_users_can_create_and_list_tasks(self):
+        self.create_user('michael', 'python')
+        self.login('michael', 'python')
+        response = self.post_task()
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.headers['Location'].endswith('/api/v1/tasks/1'))
+        tasks = json.loads(self.app.get('/api/v1/tasks/').data)['tasks']
+        self.assertEqual([task['name'] for task in tasks], ['Go to the bank'])
+        self.assertEqual(tasks[0]['poster'], 'michael')
+        self.assertEqual(tasks[0]['status'], 'open')
+
+    def test_invalid_tasks_are_rejected(self):
+        self.create_user('michael', 'python')
+        self.login('michael', 'python')
+        response = self.app.post('/api/v1/tasks/',
+                                 content_type='application/json',
+                                 data=json.dumps(dict(name='Go to the bank')))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('due_date', json.loads(response.data)['errors'])
+
+    def test_unchanged_list_is_not_modified(self):
+        self.create_user('michael', 'python')
+        self.login('michael', 'python')
+        self.post_task()
+        etag = self.app.get('/api/v1/tasks/').headers['ETag']
+        response = self.app.get('/api/v1/tasks/',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.post_task('Go to the shop')
+        response = self.app.get('/api/v1/tasks/',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_completing_a_task_changes_its_etag(self):
+        self.create_user('michael', 'python')
+        self.login('michael', 'python')
+        self.post_task()
+        etag = self.app.get('/api/v1/tasks/1').headers['ETag']
+        response = self.app.post('/api/v1/tasks/1/complete')
+        self.assertEqual(response.status_code, 200)
+        response = self.app.get('/api/v1/tasks/1',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['status'], 'closed')
+
+    def test_users_cannot_change_tasks_not_created_by_them(self):
+        self.create_user('michael', 'python')
+        self.login('michael', 'python')
+        self.post_task()
+        self.app.get('logout/')
+        self.create_user('fletcher', 'python101')
+        self.login('fletcher', 'python101')
+        self.assertEqual(
+            self.app.post('/api/v1/tasks/1/complete').status_code, 403)
+        self.assertEqual(self.app.delete('/api/v1/tasks/1').status_code, 403)
+        self.assertEqual(db.session.query(Task).count(), 1)
+
+    def test_deleting_a_missing_task_is_not_found(self):
+        self.create_user('michael', 'python')
+        self.login('michael', 'python')
+        self.assertEqual(self.app.delete('/api/v1/tasks/1').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
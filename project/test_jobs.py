@@ -0,0 +1,168 @@
+import json
+import unittest
+from datetime import date, datetime, timedelta
+
+from fixtures import AppTestCase, create_test_app
+from extensions import db
+from models import Job, Task, User
+
+from jobs import FAILED, QUEUED, Worker, enqueue, job, requeue_stale, \
+    schedule_job, schedule_jobs
+import reminders
+
+
+app = create_test_app()
+
+calls = []
+
+
+@job('test_record')
+def record(value):
+    calls.append(value)
+
+
+@job('test_fail', max_attempts=2)
+def fail():
+    raise ValueError('no good')
+
+
+@job('test_fail_once', max_attempts=1)
+def fail_once():
+    raise ValueError('no good')
+
+
+class JobTests(AppTestCase):
+
+    flask_app = app
+
+    def setUp(self):
+        super(JobTests, self).setUp()
+        del calls[:]
+        del reminders.outbox[:]
+        self.worker = Worker(app, 1)
+
+    def test_queued_jobs_run_once_and_are_deleted(self):
+        enqueue('test_record', {'value': 1})
+        enqueue('test_record', {'value': 2})
+        db.session.commit()
+        self.assertEqual(self.worker.drain(), 2)
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(db.session.query(Job).count(), 0)
+        self.assertEqual(self.worker.drain(), 0)
+
+    def test_jobs_only_run_once_they_are_due(self):
+        enqueue('test_record', {'value': 1}, delay=60)
+        db.session.commit()
+        self.assertEqual(self.worker.drain(), 0)
+        db.session.query(Job).update(
+            {Job.run_at: datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        self.assertEqual(self.worker.drain(), 1)
+        self.assertEqual(calls, [1])
+
+    def test_enqueued_jobs_are_part_of_the_transaction(self):
+        enqueue('test_record', {'value': 1})
+        db.session.rollback()
+        self.assertEqual(self.worker.drain(), 0)
+
+    def test_failed_jobs_are_retried_later_then_given_up(self):
+        enqueue('test_fail')
+        db.session.commit()
+        before = datetime.utcnow()
+        self.assertEqual(self.worker.drain(), 1)
+        failed = db.session.query(Job).one()
+        self.assertEqual((failed.status, failed.attempts), (QUEUED, 1))
+        self.assertIn('ValueError: no good', failed.last_error)
+        self.assertGreaterEqual(
+            failed.run_at, before + timedelta(
+                seconds=app.config['JOBS_RETRY_DELAY']))
+        failed.run_at = before
+        db.session.commit()
+        self.assertEqual(self.worker.drain(), 1)
+        failed = db.session.query(Job).one()
+        self.assertEqual((failed.status, failed.attempts), (FAILED, 2))
+
+    def test_jobs_without_a_handler_fail(self):
+        enqueue('no_such_job')
+        db.session.commit()
+        self.worker.drain()
+        self.assertIn('No handler', db.session.query(Job).one().last_error)
+
+    def test_jobs_left_running_by_a_dead_worker_are_rerun(self):
+        queued = enqueue('test_record', {'value': 1})
+        queued.status, queued.attempts = 'running', 1
+        queued.locked_at = datetime.utcnow() - timedelta(
+            seconds=app.config['JOBS_LOCK_TIMEOUT'] + 1)
+        db.session.commit()
+        self.assertEqual(requeue_stale(), 1)
+        db.session.query(Job).update({Job.run_at: datetime.utcnow()})
+        db.session.commit()
+        self.assertEqual(self.worker.drain(), 1)
+        self.assertEqual(calls, [1])
+
+    def test_scheduled_jobs_queue_their_next_run(self):
+        schedule = app.config['JOBS_SCHEDULE']
+        app.config['JOBS_SCHEDULE'] = [('test_record', 600)]
+        try:
+            schedule_jobs()
+            schedule_jobs()
+            self.assertEqual(db.session.query(Job).count(), 1)
+            db.session.query(Job).update({Job.arguments: json.dumps(
+                {'value': 1})})
+            db.session.commit()
+            self.assertEqual(self.worker.drain(), 1)
+            queued = db.session.query(Job).one()
+        finally:
+            app.config['JOBS_SCHEDULE'] = schedule
+        self.assertEqual(queued.name, 'test_record')
+        self.assertGreater(queued.run_at,
+                           datetime.utcnow() + timedelta(seconds=590))
+
+    def test_failed_scheduled_jobs_still_queue_their_next_run(self):
+        schedule = app.config['JOBS_SCHEDULE']
+        app.config['JOBS_SCHEDULE'] = [('test_fail', 600),
+                                       ('test_fail_once', 600)]
+        try:
+            schedule_jobs()
+            self.assertEqual(self.worker.drain(), 2)
+            # test_fail is waiting for its retry: no second run for it yet
+            jobs = dict(((queued.name, queued.status), queued) for queued in
+                        db.session.query(Job))
+            self.assertEqual(sorted(jobs), [
+                ('test_fail', QUEUED), ('test_fail_once', FAILED),
+                ('test_fail_once', QUEUED)])
+            self.assertEqual(jobs['test_fail_once', QUEUED].attempts, 0)
+            self.assertGreater(jobs['test_fail_once', QUEUED].run_at,
+                               datetime.utcnow() + timedelta(seconds=590))
+            self.assertFalse(schedule_job('test_fail_once'))
+        finally:
+            app.config['JOBS_SCHEDULE'] = schedule
+
+    def test_owners_are_reminded_of_tasks_due_soon_once(self):
+        for name in ('michael', 'fletcher'):
+            db.session.add(User(name, name + '@realpython.com', 'python'))
+        db.session.flush()
+        today = date(2015, 2, 5)
+        for name, due_date, status, user_id in [
+                ('Due tomorrow', date(2015, 2, 6), 1, 1),
+                ('Overdue', date(2015, 2, 1), 1, 1),
+                ('Due next week', date(2015, 2, 12), 1, 1),
+                ('Done', date(2015, 2, 6), 0, 1),
+                ('Due today', date(2015, 2, 5), 1, 2)]:
+            db.session.add(Task(name, due_date, 1, today, status, user_id))
+        db.session.commit()
+        self.assertEqual(reminders.queue_reminders(today), 2)
+        self.assertEqual(reminders.queue_reminders(today), 0)
+        self.assertEqual(self.worker.drain(), 2)
+        mail = dict((message['To'], message.get_payload())
+                    for message in reminders.outbox)
+        self.assertEqual(sorted(mail), ['fletcher@realpython.com',
+                                        'michael@realpython.com'])
+        self.assertIn('Overdue - due 02/01/2015\n  Due tomorrow',
+                      mail['michael@realpython.com'])
+        self.assertNotIn('next week', mail['michael@realpython.com'])
+        self.assertNotIn('Done', mail['michael@realpython.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
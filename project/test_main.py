@@ -1,28 +1,25 @@
 import os
+import json
+import shutil
+import tempfile
 import unittest
 
-from views import app, db
-from _config import basedir
+from sqlalchemy import event
+
+from fixtures import AppTestCase, create_test_app
+from extensions import db, error_log, user_cache
+from errorlog import ErrorLogWriter
 from models import User
 
-from views import bcrypt
+from extensions import bcrypt
+import views
 
 
-TEST_DB = 'test.db'
+app = create_test_app()
 
-class MainTests(unittest.TestCase):
-    # setup/teardown before/after each test
-    def setUp(self):
-        app.config['TESTING'] = True
-        app.config['WTF_CSRF_ENABLED'] = False
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
-                                                os.path.join(basedir, TEST_DB)
-        self.app = app.test_client()
-        db.create_all()
+class MainTests(AppTestCase):
 
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
+    flask_app = app
 
     # helper methods
     def login(self, name, password):
@@ -34,6 +31,65 @@ class MainTests(unittest.TestCase):
         response = self.app.get('/this-route-does-not-exist')
         self.assertEquals(response.status_code, 404)
 
+    def test_404_error_is_logged(self):
+        log_dir = tempfile.mkdtemp()
+        path = os.path.join(log_dir, 'error.log')
+        logged_app = create_test_app(ERROR_LOG_PATH=path)
+        try:
+            logged_app.test_client().get('/this-route-does-not-exist')
+            with logged_app.app_context():
+                error_log.flush()
+            with open(path) as f:
+                record = json.loads(f.readline())
+            self.assertEqual(record['status'], 404)
+            self.assertTrue(record['url'].endswith('/this-route-does-not-exist'))
+            # nothing went to this module's app's log
+            self.assertEqual(app.extensions['error_log'].path, os.devnull)
+        finally:
+            shutil.rmtree(log_dir)
+
+    def test_apps_keep_their_own_caches(self):
+        other_app = create_test_app()
+        self.assertEqual(user_cache.get(1, lambda user_id: 'this'), 'this')
+        with other_app.app_context():
+            self.assertEqual(user_cache.get(1, lambda user_id: 'other'),
+                             'other')
+        self.assertEqual(user_cache.get(1, lambda user_id: 'again'), 'this')
+
+    def test_error_log_rotates(self):
+        log_dir = tempfile.mkdtemp()
+        writer = ErrorLogWriter(os.path.join(log_dir, 'error.log'),
+                                max_bytes=100, backup_count=2,
+                                batch_size=500, queue_size=10)
+        try:
+            for status in range(5):
+                writer.write([{'status': status, 'url': 'x' * 40}])
+            self.assertEqual(sorted(os.listdir(log_dir)),
+                             ['error.log', 'error.log.1', 'error.log.2'])
+            with open(writer.path) as f:
+                self.assertEqual(json.loads(f.readline())['status'], 4)
+        finally:
+            shutil.rmtree(log_dir)
+
+    def pings(self, flask_app):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        with flask_app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                db.session.execute('SELECT 2')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+                db.session.remove()
+        return statements.count('SELECT 1')
+
+    def test_only_database_servers_are_pinged_by_default(self):
+        self.assertEqual(self.pings(app), 0)
+        self.assertEqual(self.pings(create_test_app(
+            SQLALCHEMY_POOL_PRE_PING=True)), 1)
+
     def test_500_error(self):
         bad_user = User(
             name='Jeremy',
@@ -42,7 +98,12 @@ class MainTests(unittest.TestCase):
         )
         db.session.add(bad_user)
         db.session.commit()
-        response = self.login('Jeremy', 'django')
+        # let the error reach the 500 handler instead of the test
+        app.config['PROPAGATE_EXCEPTIONS'] = False
+        try:
+            response = self.login('Jeremy', 'django')
+        finally:
+            app.config['PROPAGATE_EXCEPTIONS'] = None
         self.assertEquals(response.status_code, 500)
 
 
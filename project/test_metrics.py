@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fixtures import AppTestCase, create_test_app
+from extensions import db
+from models import User
+
+from extensions import bcrypt, metrics
+
+
+app = create_test_app(METRICS_ENABLED=True)
+
+
+class MetricsTests(AppTestCase):
+
+    flask_app = app
+
+    def setUp(self):
+        super(MetricsTests, self).setUp()
+        app.config['METRICS_ENABLED'] = True
+        metrics.reset()
+
+    def tearDown(self):
+        app.config['METRICS_PROFILE_SAMPLE_RATE'] = 0.0
+        super(MetricsTests, self).tearDown()
+
+    def login_as(self, name, role='user'):
+        user = User(name, name + '@realpython.com',
+                    bcrypt.generate_password_hash('python', 4))
+        user.role = role
+        db.session.add(user)
+        db.session.commit()
+        self.app.post('/', data=dict(name=name, password='python'))
+
+    def test_metrics_are_admin_only(self):
+        self.login_as('michael')
+        self.assertEqual(self.app.get('/metrics/').status_code, 403)
+
+    def test_requests_are_timed_and_queries_counted(self):
+        self.login_as('superman', role='admin')
+        self.app.get('/tasks/')
+        response = self.app.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('flasktaskr_requests_total{endpoint="main.tasks",status="200"}'
+                      ' 1', response.data)
+        self.assertIn('flasktaskr_template_seconds_count{endpoint="main.tasks"}'
+                      ' 1',
+                      response.data)
+        # the login post looks the user up, so it issued at least one query
+        self.assertNotIn('flasktaskr_sql_statements_sum{endpoint="main.login"} 0\n',
+                         response.data)
+        self.assertIn('flasktaskr_sql_statements_count{endpoint="main.login"} 1',
+                      response.data)
+
+    def test_nothing_is_recorded_unless_enabled(self):
+        app.config['METRICS_ENABLED'] = False
+        self.app.get('/')
+        self.assertNotIn('endpoint="main.login"', metrics.render())
+
+    def test_slow_requests_are_profiled(self):
+        directory = tempfile.mkdtemp()
+        app.config['METRICS_PROFILE_DIR'] = directory
+        app.config['METRICS_PROFILE_SAMPLE_RATE'] = 1.0
+        app.config['METRICS_SLOW_REQUEST'] = 0
+        try:
+            self.app.get('/')
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertTrue(os.listdir(directory)[0].startswith('main.login-'))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
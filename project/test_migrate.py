@@ -0,0 +1,156 @@
+import unittest
+from datetime import date, datetime
+
+from fixtures import AppTestCase, create_test_app
+from extensions import db
+from models import CLOSED, OPEN, ArchivedTask, Task, TaskEvent, User
+from search import filter_tasks
+
+import db_migrate
+from sqlalchemy import column, select, table, text
+
+
+app = create_test_app()
+
+
+class MigrateTests(AppTestCase):
+
+    flask_app = app
+
+    def setUp(self):
+        super(MigrateTests, self).setUp()
+        self.connection = db_migrate.connect()
+        # the users table as it was before roles were added
+        User.__table__.drop(self.connection)
+        self.connection.execute(text("""CREATE TABLE users (
+            id INTEGER NOT NULL PRIMARY KEY, name VARCHAR NOT NULL UNIQUE,
+            email VARCHAR NOT NULL UNIQUE, password VARCHAR NOT NULL)"""))
+        self.insert_old_users('users', 1, 6)
+
+    def insert_old_users(self, name, start, stop, **extra):
+        users = table(name, *[column(key) for key in
+                              ['id', 'name', 'email', 'password'] + list(extra)])
+        rows = []
+        for i in range(start, stop):
+            row = dict(id=i, name='user{0}'.format(i),
+                       email='user{0}@realpython.com'.format(i),
+                       password='pw')
+            row.update(extra)
+            rows.append(row)
+        self.connection.execute(users.insert(), rows)
+
+    def tearDown(self):
+        self.connection.close()
+        super(MigrateTests, self).tearDown()
+
+    def test_migrate_copies_users_in_batches(self):
+        db_migrate.migrate(batch_size=2)
+        users = db.session.query(User).order_by(User.id).all()
+        self.assertEqual([user.id for user in users], [1, 2, 3, 4, 5])
+        self.assertEqual(set(user.role for user in users), set(['user']))
+        self.assertEqual(db_migrate.current_version(self.connection),
+                         db_migrate.latest_version())
+        self.assertFalse(db_migrate.table_exists(self.connection, 'old_users'))
+
+    def test_migrate_resumes_an_interrupted_copy(self):
+        # a run that died after renaming the table and copying one batch
+        self.connection.execute(text("ALTER TABLE users RENAME TO old_users"))
+        User.__table__.create(self.connection)
+        self.insert_old_users('users', 1, 3, role='user')
+        db_migrate.migrate(batch_size=2)
+        self.assertEqual(db.session.query(User).count(), 5)
+
+    def test_schema_changes_roll_back_together(self):
+        with self.assertRaises(RuntimeError):
+            with db_migrate.ddl_transaction(self.connection):
+                self.connection.execute(text(
+                    "ALTER TABLE users RENAME TO old_users"))
+                raise RuntimeError()
+        self.assertTrue(db_migrate.table_exists(self.connection, 'users'))
+        self.assertFalse(db_migrate.table_exists(self.connection,
+                                                 'old_users'))
+
+    def test_migrate_skips_applied_steps(self):
+        db_migrate.migrate()
+        db_migrate.migrate()
+        self.assertEqual(db.session.query(User).count(), 5)
+
+    def test_migrate_casts_text_status_and_priority(self):
+        db_migrate.migrate()
+        # tasks with untyped columns, as old rows could be stored
+        self.connection.execute(text("DROP TABLE tasks"))
+        self.connection.execute(text("""CREATE TABLE tasks (
+            task_id INTEGER NOT NULL PRIMARY KEY, name VARCHAR NOT NULL,
+            due_date DATE NOT NULL, priority NOT NULL, posted_date DATE,
+            closed_date DATETIME, reminded_date DATE, status,
+            user_id INTEGER)"""))
+        tasks = table('tasks', column('task_id'), column('name'),
+                      column('due_date'), column('priority'),
+                      column('status'), column('user_id'))
+        self.connection.execute(tasks.insert(), [
+            dict(task_id=i, name='task{0}'.format(i), due_date='2015-02-05',
+                 priority='2', status='1', user_id=1) for i in range(1, 6)])
+        query = db.session.query(Task).filter(Task.status == OPEN)
+        self.assertEqual(query.count(), 0)
+        db_migrate.normalise_task_types(self.connection, batch_size=2)
+        self.assertEqual(query.count(), 5)
+        self.assertEqual(set(task.priority for task in query), set([2]))
+
+    def test_migrate_stops_task_ids_being_reused(self):
+        db_migrate.migrate()
+        # tasks as created before AUTOINCREMENT, after task 2 was archived
+        # and its id given to a new task
+        self.connection.execute(text("DROP TABLE tasks"))
+        self.connection.execute(text("""CREATE TABLE tasks (
+            task_id INTEGER NOT NULL PRIMARY KEY, name VARCHAR NOT NULL,
+            due_date DATE NOT NULL, priority INTEGER NOT NULL,
+            posted_date DATE, status SMALLINT, user_id INTEGER,
+            closed_date DATETIME, reminded_date DATETIME)"""))
+        self.connection.execute(text(
+            "CREATE INDEX ix_tasks_status_due_date "
+            "ON tasks (status, due_date, task_id)"))
+        self.connection.execute(Task.__table__.insert(), [
+            dict(task_id=i, name='Task {0}'.format(i),
+                 due_date=date(2015, 2, 5), priority=1, status=OPEN,
+                 user_id=1) for i in (1, 2)])
+        self.connection.execute(ArchivedTask.__table__.insert(), [
+            dict(task_id=i, name='Archived {0}'.format(i),
+                 due_date=date(2015, 2, 5), priority=1, status=CLOSED,
+                 user_id=1, archived_date=datetime.utcnow())
+            for i in (2, 5)])
+        db_migrate.add_task_autoincrement(self.connection, batch_size=1)
+        self.assertTrue(db_migrate.has_autoincrement(self.connection,
+                                                     'tasks'))
+        self.assertEqual(
+            [(task.task_id, task.name) for task in
+             db.session.query(Task).order_by(Task.task_id)],
+            [(1, 'Task 1'), (7, 'Task 2')])
+        db.session.add(Task('New', date(2015, 2, 5), 1, None, OPEN, 1))
+        db.session.commit()
+        self.assertEqual(
+            db.session.query(Task.task_id).filter_by(name='New').scalar(), 8)
+        # the search index follows the new ids
+        self.assertEqual([task.name for task in filter_tasks(
+            db.session.query(Task), {'q': 'Task 2'})], ['Task 2'])
+
+    def test_migrate_stops_event_ids_being_reused(self):
+        db_migrate.migrate()
+        self.connection.execute(text("DROP TABLE task_events"))
+        self.connection.execute(text("""CREATE TABLE task_events (
+            id INTEGER NOT NULL PRIMARY KEY, task_id INTEGER,
+            action VARCHAR NOT NULL, created DATETIME NOT NULL)"""))
+        self.connection.execute(TaskEvent.__table__.insert(), [
+            dict(id=i, task_id=1, action='added', created=datetime.utcnow())
+            for i in (3, 4)])
+        db_migrate.add_event_autoincrement(self.connection, batch_size=1)
+        self.assertTrue(db_migrate.has_autoincrement(self.connection,
+                                                     'task_events'))
+        self.connection.execute(TaskEvent.__table__.delete())
+        self.connection.execute(TaskEvent.__table__.insert(), dict(
+            task_id=1, action='added', created=datetime.utcnow()))
+        self.assertEqual(self.connection.scalar(
+            select([TaskEvent.__table__.c.id])), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,22 +1,37 @@
 #import sqlite3
+import csv
+import json
+import time
+from collections import namedtuple
 from functools import wraps
-from datetime import datetime
-from flask import Flask, flash, redirect, render_template, request, \
-    session, url_for
-from forms import AddTaskForm, LoginForm, RegisterForm
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime, timedelta
+from flask import Blueprint, Markup, current_app, flash, g, \
+    get_template_attribute, jsonify, redirect, render_template, request, \
+    session, stream_with_context, url_for
+from forms import AddTaskForm, BulkTaskForm, CsrfForm, LoginForm, \
+    RegisterForm, SearchForm, validate_task_row
+from flask_sqlalchemy import SignallingSession
 from sqlalchemy.exc import IntegrityError
-from flask.ext.bcrypt import Bcrypt
+from sqlalchemy.orm import joinedload
+from errorlog import request_record
+from hashing import HasherBusy
+from sqlalchemy import event
+from werkzeug.urls import url_encode
 
+from extensions import db, error_log, hasher, metrics, task_cache, \
+    user_cache
+from models import CLOSED, OPEN, ArchivedTask, Task, User, utc_today
+from pagination import encode_cursor, keyset_paginate
+from batch import ImportReport, chunks, import_rows, read_task_rows
+from search import filter_tasks
+from counters import add_counts, count_changes, move_counts, \
+    remove_counts, summary
+from events import ADDED, COMPLETED, DELETED, RELOAD, events_after, \
+    latest_event_id, record_event, record_events, streaming_enabled
 
-# Config
-app = Flask(__name__)
-app.config.from_object('_config')
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
 
-# *** I don't like this - line has to be after db =SQL.. otherwise fails!!!
-from models import Task, User
+# the HTML pages; registered on the app by create_app() in factory.py
+main = Blueprint('main', __name__)
 
 
 # helper functions
@@ -29,88 +44,298 @@ def flash_errors(form):
             flash(u"Error in the %s field - %s" %(getattr(form, field).label.text, error), 'error')
 
 
-def open_tasks():
-    return db.session.query(Task).filter_by(status='1').order_by(Task.due_date.asc())
+def task_page(status, prefix, filters, *criteria):
+    # each list keeps its own cursor in the query string, eg ?open_after=...
+    # posters are joined in up front - the template shows every poster's name
+    return keyset_paginate(
+        filter_tasks(db.session.query(Task).options(joinedload(Task.poster))
+                     .filter_by(status=status).filter(*criteria), filters),
+        Task.due_date, Task.task_id, current_app.config['TASKS_PER_PAGE'],
+        after=request.args.get(prefix + '_after'),
+        before=request.args.get(prefix + '_before'))
+
+
+def open_tasks(filters):
+    return task_page(OPEN, 'open', filters)
+
+
+def closed_tasks(filters):
+    # older ones are on their way to the archive, if not there already
+    return task_page(CLOSED, 'closed', filters,
+                     Task.closed_date >= archive_cutoff())
 
 
-def closed_tasks():
-    return db.session.query(Task).filter_by(status='0').order_by(Task.due_date.asc())
+def archive_cutoff(days=None, now=None):
+    """Tasks closed before this are old enough to archive."""
+    if days is None:
+        days = current_app.config['TASKS_ARCHIVE_AFTER_DAYS']
+    return (now or datetime.utcnow()) - timedelta(days=days)
 
 
-@app.errorhandler(404)
+def modifiable_tasks(task_ids):
+    """Query for those of the tasks the logged in user may change.
+
+    Ownership is part of the WHERE clause, so an update() or delete() on
+    this query checks and modifies in one statement and returns the number
+    of rows it touched.
+    """
+    query = db.session.query(Task).filter(Task.task_id.in_(task_ids))
+    if g.user.role != "admin":
+        query = query.filter_by(user_id=g.user.id)
+    return query
+
+
+def task_exists(task_id):
+    # only needed to explain why an update or delete touched nothing
+    return db.session.query(Task.task_id).filter_by(task_id=task_id)\
+        .first() is not None
+
+
+def touch_users(user_ids):
+    """Record that tasks belonging to these users changed.
+
+    `user_ids` is a list or a query of ids. The cached task tables are
+    dropped once the transaction commits.
+    """
+    db.session.info['tasks_changed'] = True
+    db.session.query(User).filter(User.id.in_(user_ids)).update({
+        User.task_version: User.task_version + 1,
+        User.tasks_modified: datetime.utcnow()
+    }, synchronize_session=False)
+
+
+# every write to tasks goes through these, which keep the users' change
+# counters, the task_counts summary and the task_events log in step with it
+
+
+def add_task(task):
+    db.session.add(task)
+    # for the task_id
+    db.session.flush()
+    add_counts([{'user_id': task.user_id, 'priority': task.priority,
+                 'status': task.status}])
+    record_event(task.task_id, ADDED)
+    touch_users([task.user_id])
+
+
+def add_tasks(values):
+    """Insert new tasks, a list of column dicts, with one executemany."""
+    db.session.execute(Task.__table__.insert(), values)
+    add_counts(values)
+    record_event(None, RELOAD)
+    touch_users(set(row['user_id'] for row in values))
+
+
+def complete_tasks(tasks):
+    """Mark the open tasks a modifiable_tasks() query matches as complete.
+    Returns how many there were - closed ones keep their closed_date, so
+    completing one again doesn't put off its archiving."""
+    tasks = tasks.filter(Task.status == OPEN)
+    changes = count_changes(tasks)
+    if changes:
+        record_events(tasks, COMPLETED)
+    updated = tasks.update({"status": CLOSED,
+                            "closed_date": datetime.utcnow()},
+                           synchronize_session=False)
+    if updated:
+        move_counts(changes, CLOSED)
+        touch_users(set(change[0] for change in changes))
+    return updated
+
+
+def delete_tasks(tasks):
+    """Delete the tasks a modifiable_tasks() query matches; returns how
+    many there were."""
+    changes = count_changes(tasks)
+    if changes:
+        record_events(tasks, DELETED)
+    deleted = tasks.delete(synchronize_session=False)
+    if deleted:
+        remove_counts(changes)
+        touch_users(set(change[0] for change in changes))
+    return deleted
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def invalidate_task_cache(session):
+    if session.info.pop('tasks_changed', False):
+        task_cache.invalidate()
+    for user_id in session.info.pop('users_changed', ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def forget_task_changes(session):
+    session.info.pop('tasks_changed', None)
+    session.info.pop('users_changed', None)
+
+
+def task_table(tasks, filters, prefix, closed=False):
+    """One rendered task table, from the cache when nothing has changed.
+
+    The links and actions in it depend on the user, their role and every
+    cursor and filter in the query string, so those are all part of the key.
+    """
+    key = '{0}:{1}:{2}:{3}'.format(g.user.id, g.user.role,
+                                   prefix, url_encode(request.args, sort=True))
+    return Markup(task_cache.fragment(key, lambda: render_template(
+        '_task_table.html', tasks=tasks(filters), prefix=prefix,
+        closed=closed)))
+
+
+def render_tasks(form, error=None):
+    search = SearchForm(request.args, csrf_enabled=False)
+    filters = search.filters()
+    events_url = None
+    if streaming_enabled():
+        # read before the tables, so the stream replays anything they miss
+        events_url = url_for('main.task_events', after=latest_event_id(),
+                             **dict((key, value) for key, value in
+                                    request.args.items()
+                                    if key in search.data))
+    return render_template(
+        'tasks.html',
+        form=form,
+        bulk_form=BulkTaskForm(),
+        search=search,
+        filtered=bool(filters),
+        events_url=events_url,
+        error=error,
+        open_table=task_table(open_tasks, filters, 'open'),
+        closed_table=task_table(closed_tasks, filters, 'closed',
+                                closed=True),
+        username=g.user.name
+    )
+
+
+@main.app_template_test()
+def modifiable(task):
+    return task.user_id == g.user.id or g.user.role == "admin"
+
+
+@main.app_template_global()
+def page_url(prefix, endpoint='main.tasks', **cursor):
+    """Link to a list page (/tasks/ unless `endpoint` says otherwise)
+    moving one list's cursor but keeping everything else."""
+    args = dict((key, value) for key, value in request.args.items()
+                if not key.startswith(prefix + '_'))
+    for direction, value in cursor.items():
+        args['{0}_{1}'.format(prefix, direction)] = value
+    return url_for(endpoint, **args)
+
+
+@main.app_errorhandler(404)
 def not_found(error):
-    if app.debug is not True:
-        now = datetime.now()
-        r = request.url
-        with open('error.log', 'a') as f:
-            current_timestamp = now.strftime("%d-%m-%Y %H:%D:%M:%S")
-            f.write("\x§x§n404 error at {}: {}".format(current_timestamp, r))
+    if current_app.debug is not True:
+        error_log.log(request_record(request, 404))
     return render_template('404.html'), 404
 
 
-@app.errorhandler(500)
+@main.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
-    if app.debug is not True:
-        now = datetime.now()
-        r = request.url
-        with open('error.log', 'a') as f:
-            current_timestamp = now.strftime("%d-%m-%Y %H:%D:%M:%S")
-            f.write("\n500 error at {}: {}".format(current_timestamp, r))
+    if current_app.debug is not True:
+        error_log.log(request_record(request, 500, error))
     return render_template('500.html'), 500
 
 
-@app.route('/register/', methods=['GET', 'POST'])
+BUSY_MESSAGE = 'Too many people are signing in right now - try again shortly'
+
+
+@main.route('/register/', methods=['GET', 'POST'])
 def register():
     error = None
     form = RegisterForm(request.form)
     if request.method == 'POST':
         if form.validate_on_submit():
-            print "processes validatied on submit"
+            try:
+                password = hasher.generate(form.password.data)
+            except HasherBusy:
+                error = BUSY_MESSAGE
+                return render_template('register.html', form=form,
+                                       error=error), 503
             new_user = User(
                 form.name.data,
                 form.email.data,
-                bcrypt.generate_password_hash(form.password.data)
+                password
             )
             try:
                 db.session.add(new_user)
                 db.session.commit()
                 flash('thanks for registering. Now log in')
-                return redirect(url_for('login'))
+                return redirect(url_for('main.login'))
             except IntegrityError:
                 error = "User already exists with that name"
                 return render_template('register.html', form=form, error=error)
     return render_template('register.html', form=form, error=error)
 
 
+# The session cookie only holds the user's id and session_version; the rest
+# of what a request needs to know about them comes from user_cache, so most
+# requests don't query the users table at all.
+CurrentUser = namedtuple('CurrentUser', 'id name role session_version')
+
+
+def fetch_user(user_id):
+    row = db.session.query(User.id, User.name, User.role,
+                           User.session_version).filter_by(id=user_id).first()
+    return CurrentUser(*row) if row else None
+
+
+@main.before_app_request
+def load_user():
+    g.user = None
+    if 'uid' not in session:
+        return
+    user = user_cache.get(session['uid'], fetch_user)
+    if user is not None and user.session_version != session.get('ver'):
+        # perhaps only this worker's copy is out of date
+        user_cache.invalidate(session['uid'])
+        user = user_cache.get(session['uid'], fetch_user)
+    if user is None or user.session_version != session.get('ver'):
+        # the user is gone, or their role changed since they logged in
+        session.pop('uid', None)
+        session.pop('ver', None)
+        return
+    g.user = user
+
+
+def set_role(user_id, role):
+    """Change a user's role. Their existing sessions end once this is
+    committed, so nobody keeps a role they no longer have."""
+    db.session.info.setdefault('users_changed', set()).add(user_id)
+    db.session.query(User).filter_by(id=user_id).update({
+        User.role: role,
+        User.session_version: User.session_version + 1
+    }, synchronize_session=False)
+
+
 def login_required(test):
     @wraps(test)
     def wrap(*args, **kwargs):
-        if 'logged_in' in session:
+        if g.user is not None:
             return test(*args, **kwargs)
         else:
             flash('You need to login first')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
     return wrap
 
 
 # route handlers
-@app.route('/logout/')
+@main.route('/logout/')
 @login_required
 def logout():
-    session.pop('logged_in', None)
-    session.pop('user_id', None)
-    session.pop('role', None)
-    session.pop('name', None)
+    session.pop('uid', None)
+    session.pop('ver', None)
     flash('Goodbye')
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 
 # def login():
 #     error = None
 #     if request.method == 'POST':
 #         if request.form['username'] != app.config['USERNAME'] \
-#             or request.form['password'] != app.config['PASSWORD']:
+#             or request.form['password'] != current_app.config['PASSWORD']:
 #             error = 'Invalid credentials. Try again'
 #             return render_template('login.html', error=error)
 #         else:
@@ -118,20 +343,33 @@ def logout():
 #             flash('Welcome')
 #             return redirect(url_for('tasks'))
 #     return render_template('login.html')
-@app.route('/', methods=['GET', 'POST'])
+@main.route('/', methods=['GET', 'POST'])
 def login():
     error = None
     form = LoginForm(request.form)
     if request.method == 'POST':
         if form.validate_on_submit():
             user = User.query.filter_by(name=request.form['name']).first()
-            if user is not None and bcrypt.check_password_hash(user.password, request.form['password']):
-                session['logged_in'] = True
-                session['user_id'] = user.id
-                session['role'] = user.role
-                session['name'] = user.name
+            try:
+                valid = user is not None and \
+                    hasher.check(user.password, request.form['password'])
+            except HasherBusy:
+                error = BUSY_MESSAGE
+                return render_template('login.html', form=form,
+                                       error=error), 503
+            if valid and hasher.needs_rehash(user.password):
+                # the configured cost changed since this hash was made; if
+                # the pool is too busy for that now, the next login does it
+                try:
+                    user.password = hasher.generate(request.form['password'])
+                    db.session.commit()
+                except HasherBusy:
+                    pass
+            if valid:
+                session['uid'] = user.id
+                session['ver'] = user.session_version
                 flash('Welcome')
-                return redirect(url_for('tasks'))
+                return redirect(url_for('main.tasks'))
             else:
                 error = 'Invalid login credentials'
         else:
@@ -139,7 +377,7 @@ def login():
     return render_template('login.html', form=form, error=error)
 
 
-@app.route('/tasks/')
+@main.route('/tasks/')
 @login_required
 def tasks():
     # g.db = connect_db()
@@ -160,17 +398,11 @@ def tasks():
     # closed_tasks = db.session.query(Task)\
     #     .filter_by(status='0').order_by(Task.due_date.asc())
 
-    return render_template(
-        'tasks.html',
-        form=AddTaskForm(request.form),
-        open_tasks=open_tasks(),
-        closed_tasks=closed_tasks(),
-        username=session['name']
-    )
+    return render_tasks(AddTaskForm(request.form))
 
 
 # add new tasks
-@app.route('/add/', methods=['GET', 'POST'])
+@main.route('/add/', methods=['GET', 'POST'])
 @login_required
 def new_task():
     # g.db = connect_db()
@@ -200,24 +432,22 @@ def new_task():
                 form.name.data,
                 form.due_date.data,
                 form.priority.data,
-                datetime.utcnow(),
-                '1',
-                session['user_id']
+                utc_today(),
+                OPEN,
+                g.user.id
             )
-            db.session.add(new_task)
+            add_task(new_task)
             db.session.commit()
-            flash('New entry successfully posted')
-            return redirect(url_for('tasks'))
-    return render_template(
-        'tasks.html',
-        form=form,
-        error=error,
-        open_tasks=open_tasks(),
-        closed_tasks=closed_tasks())
+            return bulk_response('New entry successfully posted', 201,
+                                 task_id=new_task.task_id)
+        if wants_json():
+            return bulk_response('The task is not valid', 400,
+                                 errors=form.errors)
+    return render_tasks(form, error)
 
 
 # Mark tests as complete
-@app.route('/complete/<int:task_id>/')
+@main.route('/complete/<int:task_id>/')
 @login_required
 def complete(task_id):
     # g.db   = connect_db()
@@ -225,20 +455,19 @@ def complete(task_id):
     # g.db.commit()
     # g.db.close()
 
-    new_id = task_id
-    task = db.session.query(Task).filter_by(task_id=new_id)
-    if session['user_id'] == task.first().user_id or\
-            session['role'] == "admin":
-        task.update({"status": "0"})
-        db.session.commit()
-        flash('task was marked as complete')
-        return redirect(url_for('tasks'))
-    else:
-        flash('You can only update tasks that belong to you')
-        return redirect(url_for('tasks'))
+    updated = complete_tasks(modifiable_tasks([task_id]))
+    db.session.commit()
+    if updated:
+        return bulk_response('task was marked as complete')
+    elif modifiable_tasks([task_id]).count():
+        return bulk_response('task was already complete')
+    elif task_exists(task_id):
+        return bulk_response('You can only update tasks that belong to you',
+                             403)
+    return bulk_response('That task does not exist', 404)
 
 
-@app.route('/delete/<int:task_id>/')
+@main.route('/delete/<int:task_id>/')
 @login_required
 def delete_entry(task_id):
     # g.db = connect_db()
@@ -246,14 +475,284 @@ def delete_entry(task_id):
     # g.db.commit()
     # g.db.close()
 
-    new_id = task_id
-    task = db.session.query(Task).filter_by(task_id=new_id)
-    if session['user_id'] == task.first().user_id or\
-            session['role'] == "admin":
-        task.delete()
+    deleted = delete_tasks(modifiable_tasks([task_id]))
+    db.session.commit()
+    if deleted:
+        return bulk_response('task was deleted')
+    elif task_exists(task_id):
+        return bulk_response('You can only delete tasks that belong to you',
+                             403)
+    return bulk_response('That task does not exist', 404)
+
+
+# bulk operations - many tasks in one request, one transaction and one
+# response. They take a form post (redirecting back to the task list) or
+# JSON (answered with JSON).
+BULK_CHUNK_SIZE = 500
+CSRF_MESSAGE = 'The form had expired - reload the page and try again'
+# what any page can make a browser post to us; other bodies (JSON, CSV) need
+# the browser to ask first, and it won't for another site
+FORM_MIMETYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+
+def wants_json():
+    return request.mimetype == 'application/json' or \
+        request.accept_mimetypes.best == 'application/json'
+
+
+def bulk_response(message, status=200, **data):
+    if wants_json():
+        response = jsonify(message=message, **data)
+        response.status_code = status
+        return response
+    flash(message)
+    return redirect(url_for('main.tasks'))
+
+
+def csrf_failed():
+    """True if this is a form post without a valid CSRF token."""
+    return request.mimetype in FORM_MIMETYPES and \
+        not CsrfForm().validate_on_submit()
+
+
+def bulk_task_form():
+    """The request's BulkTaskForm. Like csrf_failed(), only form posts
+    need the CSRF token; JSON ones are read without it."""
+    if request.mimetype in FORM_MIMETYPES:
+        return BulkTaskForm()
+    return BulkTaskForm(csrf_enabled=False)
+
+
+@main.route('/complete/', methods=['POST'])
+@login_required
+def complete_many():
+    form = bulk_task_form()
+    if not form.validate_on_submit():
+        if 'csrf_token' in form.errors:
+            return bulk_response(CSRF_MESSAGE, 400)
+        return bulk_response('No tasks were selected', 400)
+    updated = 0
+    for task_ids in chunks(form.task_ids.data, BULK_CHUNK_SIZE):
+        updated += complete_tasks(modifiable_tasks(task_ids))
+    db.session.commit()
+    return bulk_response('{0} task(s) marked as complete'.format(updated),
+                         updated=updated)
+
+
+@main.route('/delete/', methods=['POST'])
+@login_required
+def delete_many():
+    form = bulk_task_form()
+    if not form.validate_on_submit():
+        if 'csrf_token' in form.errors:
+            return bulk_response(CSRF_MESSAGE, 400)
+        return bulk_response('No tasks were selected', 400)
+    deleted = 0
+    for task_ids in chunks(form.task_ids.data, BULK_CHUNK_SIZE):
+        deleted += delete_tasks(modifiable_tasks(task_ids))
+    db.session.commit()
+    return bulk_response('{0} task(s) deleted'.format(deleted),
+                         deleted=deleted)
+
+
+def task_row_validator(user_id):
+    """validate(row) -> (insert values, errors) for rows of new tasks
+    belonging to user_id."""
+    today = utc_today()
+
+    def validate(row):
+        form, errors = validate_task_row(row)
+        if errors:
+            return None, errors
+        return {
+            'name': form.name.data,
+            'due_date': form.due_date.data,
+            'priority': form.priority.data,
+            'posted_date': today,
+            'status': OPEN,
+            'user_id': user_id,
+        }, None
+    return validate
+
+
+def import_tasks(rows, user_id, batch_size=None, report=None):
+    """Add the valid rows as user_id's tasks, committing each batch as one
+    executemany. Invalid rows are reported and skipped."""
+    def insert(batch):
+        add_tasks(batch)
         db.session.commit()
-        flash('task was deleted')
-        return redirect((url_for('tasks')))
-    else:
-        flash('You can only delete tasks that belong to you')
-        return redirect(url_for('tasks'))
+    return import_rows(rows, task_row_validator(user_id), insert,
+                       batch_size or current_app.config['IMPORT_BATCH_SIZE'], report)
+
+
+@main.route('/add/bulk/', methods=['POST'])
+@login_required
+def new_tasks():
+    """Add every task in a JSON list or CSV upload, or none of them."""
+    if csrf_failed():
+        return bulk_response(CSRF_MESSAGE, 400)
+    try:
+        rows = list(read_task_rows(request))
+    except (ValueError, csv.Error) as e:
+        return bulk_response(str(e), 400)
+    if not rows:
+        return bulk_response('No tasks were sent', 400)
+    validate = task_row_validator(g.user.id)
+    values, errors = [], []
+    for number, row in enumerate(rows, 1):
+        row_values, row_errors = validate(row)
+        if row_errors:
+            errors.append({'row': number, 'errors': row_errors})
+            continue
+        values.append(row_values)
+    if errors:
+        return bulk_response('{0} task(s) were invalid - nothing was added'
+                             .format(len(errors)), 400, errors=errors)
+    for batch in chunks(values, BULK_CHUNK_SIZE):
+        add_tasks(batch)
+    db.session.commit()
+    return bulk_response('{0} task(s) added'.format(len(values)),
+                         added=len(values))
+
+
+@main.route('/import/', methods=['POST'])
+@login_required
+def import_many():
+    """Add the valid tasks in a JSON list or CSV upload, however many.
+
+    Unlike /add/bulk/, bad rows don't stop the rest: they are listed in the
+    response by row number and everything else is imported. JSON is
+    read a row at a time, so the size of the list doesn't matter.
+    """
+    if csrf_failed():
+        return bulk_response(CSRF_MESSAGE, 400)
+    report = ImportReport()
+    try:
+        import_tasks(read_task_rows(request), g.user.id,
+                     report=report)
+    except (ValueError, csv.Error) as e:
+        return bulk_response('{0} - {1} task(s) were imported before that'
+                             .format(e, report.imported), 400,
+                             **report.as_dict())
+    message = '{0} task(s) imported'.format(report.imported)
+    if report.errors:
+        message += ', {0} invalid row(s) skipped'.format(len(report.errors))
+    return bulk_response(message, **report.as_dict())
+
+
+@main.route('/dashboard/')
+@login_required
+def dashboard():
+    """Open, closed and overdue tasks per user and priority - every user's
+    for admins, otherwise just your own."""
+    user_ids = None if g.user.role == "admin" else [g.user.id]
+    users = summary(user_ids)
+    if wants_json():
+        return jsonify(users=users)
+    return render_template('dashboard.html', users=users,
+                           username=g.user.name)
+
+
+@main.route('/archive/')
+@login_required
+def archive():
+    tasks = keyset_paginate(
+        db.session.query(ArchivedTask)
+        .options(joinedload(ArchivedTask.poster)),
+        ArchivedTask.due_date, ArchivedTask.task_id,
+        current_app.config['TASKS_PER_PAGE'],
+        after=request.args.get('archived_after'),
+        before=request.args.get('archived_before'))
+    return render_template('archive.html', tasks=tasks,
+                           username=g.user.name)
+
+
+def task_messages(events, filters):
+    """The server-sent event for each change: the task's row as it now
+    appears in one of the lists (if it still matches `filters`), for the
+    page to swap in for the old one."""
+    ids = set(event.task_id for event in events if event.task_id is not None)
+    tasks = {}
+    if ids:
+        tasks = dict((task.task_id, task) for task in filter_tasks(
+            db.session.query(Task).options(joinedload(Task.poster))
+            .filter(Task.task_id.in_(ids)), filters))
+    task_row = get_template_attribute('_task_row.html', 'task_row')
+    for event in events:
+        data = {'action': event.action, 'task_id': event.task_id}
+        task = tasks.get(event.task_id)
+        if task is not None and event.action != DELETED:
+            closed = task.status == CLOSED
+            data.update(list='closed' if closed else 'open',
+                        key=encode_cursor(task.due_date, task.task_id),
+                        html=task_row(task, closed))
+        yield 'id: {0}\ndata: {1}\n\n'.format(event.id, json.dumps(data))
+
+
+def event_stream(last_id, filters):
+    config = current_app.config
+    # how long the browser waits before reconnecting
+    yield 'retry: {0}\n\n'.format(int(config['TASK_EVENTS_POLL'] * 1000))
+    started = quiet = time.time()
+    while True:
+        events = events_after(last_id, config['TASK_EVENTS_BATCH'])
+        if events:
+            last_id = events[-1].id
+            quiet = time.time()
+            for message in task_messages(events, filters):
+                yield message
+        elif time.time() - quiet >= config['TASK_EVENTS_KEEPALIVE']:
+            # a comment, so proxies keep the connection open and a closed
+            # one is noticed
+            quiet = time.time()
+            yield ': keepalive\n\n'
+        # hand the connection back to the pool (and let go of SQLite's
+        # read snapshot) between polls
+        db.session.remove()
+        if time.time() - started >= config['TASK_EVENTS_TIMEOUT']:
+            return
+        if not events:
+            time.sleep(config['TASK_EVENTS_POLL'])
+
+
+@main.route('/tasks/events/')
+@login_required
+def task_events():
+    """Changes to the task lists as server-sent events, from the one after
+    Last-Event-ID (or ?after=) on. Takes the same search filters as /tasks/.
+
+    The stream ends after TASK_EVENTS_TIMEOUT seconds and the browser
+    reconnects where it left off, so no worker is held for good. Where
+    streams aren't served (see streaming_enabled) the answer is 204, which
+    tells the browser to stop reconnecting.
+    """
+    if not streaming_enabled():
+        return '', 204
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('after', type=int)
+    if last_id is None:
+        last_id = latest_event_id()
+    filters = SearchForm(request.args, csrf_enabled=False).filters()
+    return current_app.response_class(
+        stream_with_context(event_stream(last_id, filters)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@main.route('/cache/stats/')
+@login_required
+def cache_stats():
+    if g.user.role != "admin":
+        return jsonify(message='Only admins can see cache statistics'), 403
+    return jsonify(task_cache.stats())
+
+
+@main.route('/metrics/')
+@login_required
+def metrics_report():
+    if g.user.role != "admin":
+        return jsonify(message='Only admins can see metrics'), 403
+    return current_app.response_class(metrics.render(),
+                                      mimetype='text/plain; version=0.0.4')
+
@@ -0,0 +1,36 @@
+import argparse
+
+from factory import create_app
+from jobs import Worker
+# imported for the jobs they define
+import archive
+import counters
+import reminders
+
+
+# Runs the background jobs (see jobs.py) - start one or more of these next
+# to the web workers.
+#
+#   python worker.py                    until stopped, JOBS_CONCURRENCY at once
+#   python worker.py --concurrency 4
+#   python worker.py --once             run whatever is due, then exit
+
+
+def main():
+    app = create_app()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int,
+                        default=app.config['JOBS_CONCURRENCY'])
+    parser.add_argument('--once', action='store_true')
+    args = parser.parse_args()
+
+    worker = Worker(app, args.concurrency)
+    if args.once:
+        worker.start()
+        print('{0} job(s) run'.format(worker.drain()))
+    else:
+        worker.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+from factory import create_app
+
+
+# for gunicorn and friends: gunicorn -c gunicorn.conf.py wsgi:app
+app = create_app()